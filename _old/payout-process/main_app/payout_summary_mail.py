@@ -8,6 +8,8 @@ from logger_util import logger
 
 
 ERROR = 'Error: {0}'
+# multiple of 3 bytes, so that no padding is emitted in the middle of the stream
+ATTACHMENT_CHUNK_SIZE = 3 * 64 * 1024
 
 def payout_summary_mail(csv_name, epoch_no, do_send_email):
    
@@ -18,12 +20,12 @@ def payout_summary_mail(csv_name, epoch_no, do_send_email):
                     plain_text_content='Please find the attached list of payout summary details',
                     html_content='<p> Please find the attached list of payout summary details </p>')
 
+        b64data = bytearray()
         with open(csv_name, 'rb') as fd:
-            data = fd.read()
-            fd.close()
-        b64data = base64.b64encode(data)
+            for chunk in iter(lambda: fd.read(ATTACHMENT_CHUNK_SIZE), b''):
+                b64data += base64.b64encode(chunk)
         attch_file = Attachment(
-            FileContent(str(b64data, 'utf-8')),
+            FileContent(b64data.decode('ascii')),
             FileName(csv_name),
             FileType('application/csv'),
             Disposition('attachment')
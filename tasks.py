@@ -1,74 +1,74 @@
 from datetime import datetime, timedelta, timezone
-import re
 from invoke import task
-import os
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import extras, sql
+import sqlparse
+
+from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.db_pool import close_all, get_conn
+
+
+def insert_bot_logs(cursor, rows, page_size=500):
+    "Insert bot_logs rows in batches using a single multi-row INSERT per page."
+    extras.execute_values(
+        cursor,
+        "INSERT INTO bot_logs (processing_time, files_processed, file_timestamps, batch_start_epoch, batch_end_epoch) \
+        VALUES %s",
+        rows,
+        page_size=page_size,
+    )
 
 
 @task
 def create_database(ctx):
-    db_host = os.environ.get("POSTGRES_HOST")
-    db_port = os.environ.get("POSTGRES_PORT")
-    db_name = os.environ.get("POSTGRES_DB")
-    db_user = os.environ.get("POSTGRES_USER")
-    db_password = os.environ.get("POSTGRES_PASSWORD")
+    db_name = Config.POSTGRES.db
 
     # Establishing connection to PostgreSQL server
     # (connect to initial database 'postgres' to create a new database)
-    conn = psycopg2.connect(
-        host=db_host,
-        port=db_port,
-        dbname="postgres",
-        user=db_user,
-        password=db_password,
-    )
-    conn.autocommit = True
-    cursor = conn.cursor()
+    with get_conn("postgres") as conn:
+        conn.autocommit = True
+        cursor = conn.cursor()
 
-    # Creating the database
-    try:
-        cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(db_name)))
-        print(f"Database '{db_name}' created successfully")
-    except psycopg2.errors.DuplicateDatabase:
-        print(f"Database '{db_name}' already exists, not creating")
+        # Creating the database
+        try:
+            cursor.execute(
+                sql.SQL("CREATE DATABASE {}").format(sql.Identifier(db_name))
+            )
+            print(f"Database '{db_name}' created successfully")
+        except psycopg2.errors.DuplicateDatabase:
+            print(f"Database '{db_name}' already exists, not creating")
 
-    cursor.close()
-    conn.close()
+        cursor.close()
 
     # Connect to the new database
-    conn = psycopg2.connect(
-        host=db_host, port=db_port, dbname=db_name, user=db_user, password=db_password
-    )
-    conn.autocommit = True
-    cursor = conn.cursor()
-
-    # Path to the SQL script relative to tasks.py
-    sql_script_path = "uptime_service_validation/database/create_tables.sql"
-
-    # Running the SQL script file
-    with open(sql_script_path, "r") as file:
-        sql_script = file.read()
-        cursor.execute(sql_script)
+    with get_conn() as conn:
+        cursor = conn.cursor()
+
+        # Path to the SQL script relative to tasks.py
+        sql_script_path = "uptime_service_validation/database/create_tables.sql"
+
+        # Running the SQL script file statement by statement in a single
+        # transaction, so that a failure points at the offending statement
+        # and leaves no partially applied schema behind
+        with open(sql_script_path, "r") as file:
+            statements = sqlparse.split(file.read())
+        for statement in statements:
+            # skip chunks that only contain comments
+            if not sqlparse.format(statement, strip_comments=True).strip():
+                continue
+            try:
+                cursor.execute(statement)
+            except psycopg2.Error:
+                print(f"'create_tables.sql' failed at statement:\n{statement}")
+                raise
+        conn.commit()
         print("'create_tables.sql' script completed successfully")
 
-    cursor.close()
-    conn.close()
+        cursor.close()
 
 
 @task
 def init_database(ctx, batch_end_epoch=None, mins_ago=None, override_empty=False):
-    db_host = os.environ.get("POSTGRES_HOST")
-    db_port = os.environ.get("POSTGRES_PORT")
-    db_name = os.environ.get("POSTGRES_DB")
-    db_user = os.environ.get("POSTGRES_USER")
-    db_password = os.environ.get("POSTGRES_PASSWORD")
-
-    conn = psycopg2.connect(
-        host=db_host, port=db_port, dbname=db_name, user=db_user, password=db_password
-    )
-    cursor = conn.cursor()
-
     if mins_ago is not None:
         batch_end_epoch = (
             datetime.now(timezone.utc) - timedelta(minutes=int(mins_ago))
@@ -76,110 +76,112 @@ def init_database(ctx, batch_end_epoch=None, mins_ago=None, override_empty=False
     elif batch_end_epoch is None:
         batch_end_epoch = datetime.now(timezone.utc).timestamp()
     else:
-        datetime_pattern = re.compile(r"^\d{4}-\d{2}-\d{2}.\d{2}:\d{2}:\d{2}.*$")
-        # Convert batch_end_epoch to a timestamp in utc if it is a datetime string
-        # use regex to check if it is of format 'YYYY-MM-DD HH:MM:SS'
-        if datetime_pattern.match(batch_end_epoch):
-            batch_end_epoch = datetime.fromisoformat(batch_end_epoch).timestamp()
-            print(f"Converted datetime string to timestamp: {batch_end_epoch}")
-        else:
+        # batch_end_epoch is either a unix timestamp or a datetime string
+        # such as 'YYYY-MM-DD HH:MM:SS', which is converted to a timestamp
+        try:
             batch_end_epoch = int(batch_end_epoch)
             print(f"Using provided timestamp: {batch_end_epoch}")
+        except ValueError:
+            batch_end_epoch = datetime.fromisoformat(batch_end_epoch).timestamp()
+            print(f"Converted datetime string to timestamp: {batch_end_epoch}")
 
-    # Check if the table is empty, if override_empty is False
-    should_insert = True
-    if not override_empty:
-        cursor.execute("SELECT COUNT(*) FROM bot_logs")
-        count = cursor.fetchone()[0]
-        should_insert = count == 0
-
-    if should_insert:
-        processing_time = 0
-        files_processed = -1  # -1 indicates that this is initialization
-        file_timestamps = datetime.fromtimestamp(batch_end_epoch, timezone.utc)
-        batch_start_epoch = batch_end_epoch
-
-        # Inserting data into the bot_logs table
-        cursor.execute(
-            "INSERT INTO bot_logs (processing_time, files_processed, file_timestamps, batch_start_epoch, batch_end_epoch) \
-            VALUES (%s, %s, %s, %s, %s)",
-            (
-                processing_time,
-                files_processed,
-                file_timestamps,
-                batch_start_epoch,
-                batch_end_epoch,
-            ),
-        )
-        print(f"Row inserted into bot_logs table. batch_end_epoch: {batch_end_epoch}.")
-    else:
-        print(
-            "Table bot_logs is not empty. Row not inserted. You can override this by passing --override-empty."
-        )
+    with get_conn() as conn:
+        cursor = conn.cursor()
+
+        # Check if the table is empty, if override_empty is False
+        should_insert = True
+        if not override_empty:
+            cursor.execute("SELECT COUNT(*) FROM bot_logs")
+            count = cursor.fetchone()[0]
+            should_insert = count == 0
+
+        if should_insert:
+            processing_time = 0
+            files_processed = -1  # -1 indicates that this is initialization
+            file_timestamps = datetime.fromtimestamp(batch_end_epoch, timezone.utc)
+            batch_start_epoch = batch_end_epoch
+
+            # Inserting data into the bot_logs table
+            insert_bot_logs(
+                cursor,
+                [
+                    (
+                        processing_time,
+                        files_processed,
+                        file_timestamps,
+                        batch_start_epoch,
+                        batch_end_epoch,
+                    )
+                ],
+            )
+            print(
+                f"Row inserted into bot_logs table. batch_end_epoch: {batch_end_epoch}."
+            )
+        else:
+            print(
+                "Table bot_logs is not empty. Row not inserted. You can override this by passing --override-empty."
+            )
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        conn.commit()
+        cursor.close()
 
 @task
 def create_ro_user(ctx):
-    db_host = os.environ.get("POSTGRES_HOST")
-    db_port = os.environ.get("POSTGRES_PORT")
-    db_name = os.environ.get("POSTGRES_DB")
-    db_user = os.environ.get("POSTGRES_USER")
-    db_password = os.environ.get("POSTGRES_PASSWORD")
-    db_ro_user = os.environ.get("POSTGRES_RO_USER")
-    db_ro_password = os.environ.get("POSTGRES_RO_PASSWORD")
-
-    conn = psycopg2.connect(
-        host=db_host, port=db_port, dbname=db_name, user=db_user, password=db_password
-    )
-    cursor = conn.cursor()
-
-    # Check if the user exists
-    user_exists = False
-    cursor.execute("SELECT 1 FROM pg_roles WHERE rolname=%s;", (db_ro_user,))
-    user_exists = cursor.fetchone() is not None
-
-    if not user_exists:
-        cursor.execute(sql.SQL("CREATE USER {} WITH PASSWORD %s;").format(sql.Identifier(db_ro_user)), (db_ro_password,))
-        cursor.execute(sql.SQL("GRANT CONNECT ON DATABASE {} TO {};").format(sql.Identifier(db_name),sql.Identifier(db_ro_user)))
-        cursor.execute(sql.SQL("GRANT USAGE ON SCHEMA public TO {};").format(sql.Identifier(db_ro_user)))
-        cursor.execute(sql.SQL("GRANT SELECT ON ALL TABLES IN SCHEMA public TO {};").format(sql.Identifier(db_ro_user)))
-        cursor.execute(sql.SQL("ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT SELECT ON TABLES TO {};").format(sql.Identifier(db_ro_user)))
-        print(f"User {db_ro_user} created")
-    else:
-        print(f"User {db_ro_user} already exists")
+    db_name = Config.POSTGRES.db
+    db_ro_user = Config.POSTGRES_RO_USER
+    db_ro_password = Config.POSTGRES_RO_PASSWORD
+
+    with get_conn() as conn:
+        cursor = conn.cursor()
+
+        # Check if the user exists
+        user_exists = False
+        cursor.execute("SELECT 1 FROM pg_roles WHERE rolname=%s;", (db_ro_user,))
+        user_exists = cursor.fetchone() is not None
+
+        if not user_exists:
+            ro_user = sql.Identifier(db_ro_user)
+            # Send all statements in one round trip
+            statements = sql.SQL("; ").join(
+                [
+                    sql.SQL("CREATE USER {} WITH PASSWORD %s").format(ro_user),
+                    sql.SQL("GRANT CONNECT ON DATABASE {} TO {}").format(
+                        sql.Identifier(db_name), ro_user
+                    ),
+                    sql.SQL("GRANT USAGE ON SCHEMA public TO {}").format(ro_user),
+                    sql.SQL("GRANT SELECT ON ALL TABLES IN SCHEMA public TO {}").format(
+                        ro_user
+                    ),
+                    sql.SQL(
+                        "ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT SELECT ON TABLES TO {}"
+                    ).format(ro_user),
+                ]
+            )
+            cursor.execute(statements, (db_ro_password,))
+            print(f"User {db_ro_user} created")
+        else:
+            print(f"User {db_ro_user} already exists")
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        conn.commit()
+        cursor.close()
 
 @task
 def drop_database(ctx):
-    db_host = os.environ.get("POSTGRES_HOST")
-    db_port = os.environ.get("POSTGRES_PORT")
-    db_name = os.environ.get("POSTGRES_DB")
-    db_user = os.environ.get("POSTGRES_USER")
-    db_password = os.environ.get("POSTGRES_PASSWORD")
+    db_name = Config.POSTGRES.db
+
+    # Pooled connections to the database would prevent it from being dropped
+    close_all()
 
     # Establishing connection to PostgreSQL server
-    conn = psycopg2.connect(
-        host=db_host,
-        port=db_port,
-        dbname="postgres",
-        user=db_user,
-        password=db_password,
-    )
-    conn.autocommit = True
-    cursor = conn.cursor()
-
-    # Dropping the database
-    try:
-        cursor.execute(sql.SQL("DROP DATABASE {}").format(sql.Identifier(db_name)))
-        print(f"Database '{db_name}' dropped!")
-    except Exception as e:
-        print(f"Error dropping database '{db_name}'! Error: {e}")
-
-    cursor.close()
-    conn.close()
+    with get_conn("postgres") as conn:
+        conn.autocommit = True
+        cursor = conn.cursor()
+
+        # Dropping the database
+        try:
+            cursor.execute(sql.SQL("DROP DATABASE {}").format(sql.Identifier(db_name)))
+            print(f"Database '{db_name}' dropped!")
+        except Exception as e:
+            print(f"Error dropping database '{db_name}'! Error: {e}")
+
+        cursor.close()
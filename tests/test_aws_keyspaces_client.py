@@ -1,8 +1,58 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from dataclasses import asdict
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+from uptime_service_validation.coordinator import aws_keyspaces_client
 from uptime_service_validation.coordinator.aws_keyspaces_client import (
     AWSKeyspacesClient,
     ShardCalculator,
 )
+from uptime_service_validation.coordinator.helper import Submission
+
+
+@pytest.fixture
+def client():
+    "A client with a mocked session, without connecting to Keyspaces."
+    client = AWSKeyspacesClient.__new__(AWSKeyspacesClient)
+    client.aws_keyspace = "test_keyspace"
+    client.concurrency = 32
+    client.prepared_statements = {}
+    client.session = MagicMock()
+    client.auth_provider = MagicMock()
+    return client
+
+
+def assumed_role_credentials(expires_in):
+    return {
+        "Credentials": {
+            "AccessKeyId": "key",
+            "SecretAccessKey": "secret",
+            "SessionToken": "token",
+            "Expiration": datetime.now(timezone.utc) + expires_in,
+        }
+    }
+
+
+@pytest.fixture
+def assume_role(client, monkeypatch, tmp_path):
+    "Make the client assume a role through a mocked STS; return the STS call."
+    token_file = tmp_path / "token"
+    token_file.write_text("token")
+    client.role_arn = "arn:aws:iam::123456789012:role/test"
+    client.role_session_name = "test_session"
+    client.web_identity_token_file = str(token_file)
+    client.aws_region = "us-west-2"
+
+    boto3 = MagicMock()
+    boto3.Session.side_effect = lambda **kwargs: MagicMock(
+        region_name=kwargs["region_name"]
+    )
+    monkeypatch.setattr(aws_keyspaces_client, "boto3", boto3)
+    monkeypatch.setattr(aws_keyspaces_client, "_boto_sessions", {})
+    return boto3.client.return_value.assume_role_with_web_identity
 
 
 def test_get_submitted_at_date_list():
@@ -67,3 +117,220 @@ def test_calculate_shards_in_range():
         start_time, end_time
     )
     assert result_cql_statement == expected_cql_statement
+
+    # 4 range covering a full day
+    start_time = datetime(2024, 2, 28, 10, 0, 0)
+    end_time = datetime(2024, 2, 29, 10, 0, 0)
+    expected_cql_statement = f"shard in ({','.join(map(str, range(600)))})"
+    result_cql_statement = ShardCalculator.calculate_shards_in_range(
+        start_time, end_time
+    )
+    assert result_cql_statement == expected_cql_statement
+
+
+def test_shards_cached_for_consecutive_batches():
+    start = datetime(2024, 2, 29, 12, 0, 0)
+    interval = timedelta(minutes=10)
+    first = ShardCalculator.shards_tuple(start, start + interval)
+    # the next day's batch at the same time of day reuses the cached shards
+    next_start = start + timedelta(days=1)
+    assert ShardCalculator.shards_tuple(next_start, next_start + interval) is first
+    assert first == (300, 301, 302, 303, 304)
+
+
+def test_get_submissions_maps_rows(client, monkeypatch):
+    submitted_at = datetime(2024, 2, 29, 12, 58, 1)
+    created_at = datetime(2024, 2, 29, 12, 57, 59)
+    row = (
+        "2024-02-29",
+        submitted_at,
+        "submitter",
+        created_at,
+        "block_hash",
+        "remote_addr",
+        "peer_id",
+        3085,
+        "built_with_commit_sha",
+        "state_hash",
+        "parent",
+        42,
+        7,
+        None,
+        True,
+    )
+    first_page = MagicMock(current_rows=[row])
+    first_page.response_future.has_more_pages = False
+    empty_page = MagicMock(current_rows=[])
+    empty_page.response_future.has_more_pages = False
+    execute_concurrent = MagicMock(
+        return_value=[(True, first_page), (True, empty_page)]
+    )
+    monkeypatch.setattr(
+        aws_keyspaces_client, "execute_concurrent_with_args", execute_concurrent
+    )
+    start = datetime(2024, 2, 29, 23, 59, 0)
+    end = datetime(2024, 3, 1, 0, 1, 0)
+    result = client.get_submissions(
+        submitted_at_start=start, submitted_at_end=end, return_as="list"
+    )
+    # one query per submitted_at_date
+    shards = (0, 599)
+    assert execute_concurrent.call_args.args[2] == [
+        ("2024-02-29", shards, start, end),
+        ("2024-03-01", shards, start, end),
+    ]
+    assert result == [
+        Submission(
+            submitted_at_date="2024-02-29",
+            submitted_at=submitted_at,
+            submitter="submitter",
+            created_at=created_at,
+            block_hash="block_hash",
+            remote_addr="remote_addr",
+            peer_id="peer_id",
+            graphql_control_port=3085,
+            built_with_commit_sha="built_with_commit_sha",
+            state_hash="state_hash",
+            parent="parent",
+            height=42,
+            slot=7,
+            validation_error=None,
+            verified=True,
+        )
+    ]
+
+
+def test_get_submissions_in_intervals_runs_all_queries_at_once(client, monkeypatch):
+    rows = [("2024-02-29",) + (None,) * 13 + (True,), ("2024-03-01",) + (None,) * 14]
+    pages = []
+    for row in rows:
+        page = MagicMock(current_rows=[row])
+        page.response_future.has_more_pages = False
+        pages.append((True, page))
+    execute_concurrent = MagicMock(return_value=pages)
+    monkeypatch.setattr(
+        aws_keyspaces_client, "execute_concurrent_with_args", execute_concurrent
+    )
+    first = (datetime(2024, 2, 29, 23, 50, 0), datetime(2024, 2, 29, 23, 55, 12))
+    second = (datetime(2024, 2, 29, 23, 55, 12), datetime(2024, 3, 1, 0, 0, 0))
+    result = client.get_submissions_in_intervals([first, second], return_as="list")
+    execute_concurrent.assert_called_once()
+    assert execute_concurrent.call_args.args[2] == [
+        ("2024-02-29", (595, 596, 597, 598), *first),
+        ("2024-02-29", (0, 598, 599), *second),
+        ("2024-03-01", (0, 598, 599), *second),
+    ]
+    assert [s.submitted_at_date for s in result] == ["2024-02-29", "2024-03-01"]
+
+
+def test_get_submissions_as_dataframe(client, monkeypatch):
+    row = (
+        "2024-02-29",
+        datetime(2024, 2, 29, 12, 58, 1),
+        "submitter",
+        datetime(2024, 2, 29, 12, 57, 59),
+        "block_hash",
+        "remote_addr",
+        "peer_id",
+        3085,
+        "built_with_commit_sha",
+        "state_hash",
+        "parent",
+        42,
+        7,
+        None,
+        True,
+    )
+    monkeypatch.setattr(client, "execute_query", MagicMock(return_value=[row]))
+    df = client.get_submissions(return_as="pandas")
+    expected = pd.DataFrame([asdict(Submission(*row[:9], None, *row[9:]))])
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_get_submissions_limit_is_pushed_down(client, monkeypatch):
+    row = ("2024-02-29",) + (None,) * 14
+    pages = []
+    for _ in range(2):
+        page = MagicMock(current_rows=[row, row])
+        page.response_future.has_more_pages = False
+        pages.append((True, page))
+    monkeypatch.setattr(
+        aws_keyspaces_client,
+        "execute_concurrent_with_args",
+        MagicMock(return_value=pages),
+    )
+    result = client.get_submissions(
+        limit=3,
+        submitted_at_start=datetime(2024, 2, 29, 23, 59, 0),
+        submitted_at_end=datetime(2024, 3, 1, 0, 1, 0),
+        return_as="list",
+    )
+    query = client.session.prepare.call_args.args[0]
+    assert query.endswith(" PER PARTITION LIMIT 3 LIMIT 3")
+    assert len(result) == 3
+
+
+def test_boto_session_refreshed_before_expiration(client, assume_role):
+    assume_role.return_value = assumed_role_credentials(timedelta(hours=1))
+    session = client._get_boto_session()
+    assert client._get_boto_session() is session
+    assert assume_role.call_count == 1
+
+    assume_role.return_value = assumed_role_credentials(timedelta(minutes=1))
+    aws_keyspaces_client._boto_sessions.clear()
+    client._get_boto_session()
+    client._get_boto_session()
+    assert assume_role.call_count == 3
+
+
+def test_sigv4_provider_authenticates_with_refreshed_session():
+    sessions = [MagicMock(region_name="us-west-2"), MagicMock(region_name="us-west-2")]
+    get_session = MagicMock(side_effect=sessions)
+    provider = aws_keyspaces_client.RefreshingSigV4AuthProvider(get_session)
+    assert provider.new_authenticator("host").session is sessions[0]
+    provider.refresh()
+    assert provider.new_authenticator("host").session is sessions[1]
+
+
+def test_expiring_credentials_refreshed_by_client(client, assume_role):
+    assume_role.return_value = assumed_role_credentials(timedelta(minutes=1))
+    provider = aws_keyspaces_client.RefreshingSigV4AuthProvider(
+        client._get_boto_session
+    )
+    client.auth_provider = provider
+    expiring = provider.session
+    # opening connections never calls STS
+    assert provider.new_authenticator("host").session is expiring
+    assert assume_role.call_count == 1
+
+    assume_role.return_value = assumed_role_credentials(timedelta(hours=1))
+    client.refresh_credentials()
+    assert assume_role.call_count == 2
+    assert provider.session is not expiring
+    assert provider.new_authenticator("host").session is provider.session
+    # credentials far from expiring are kept
+    client.refresh_credentials()
+    assert assume_role.call_count == 2
+
+
+def test_rows_with_prefetch():
+    pages = [["row_1", "row_2"], ["row_3"], ["row_4"]]
+    future = MagicMock()
+    fetched = []
+
+    def has_more_pages():
+        return len(fetched) < len(pages) - 1
+
+    def start_fetching_next_page():
+        fetched.append(pages[len(fetched) + 1])
+
+    type(future).has_more_pages = property(lambda self: has_more_pages())
+    future.start_fetching_next_page.side_effect = start_fetching_next_page
+    future.result.side_effect = lambda: MagicMock(current_rows=fetched[-1])
+    result = MagicMock(response_future=future, current_rows=pages[0])
+
+    rows = aws_keyspaces_client._rows_with_prefetch(result)
+    # the second page is requested before the first row is handed out
+    assert next(rows) == "row_1"
+    assert future.start_fetching_next_page.call_count == 1
+    assert list(rows) == ["row_2", "row_3", "row_4"]
@@ -0,0 +1,274 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pandas as pd
+import psycopg2
+import pytest
+
+from uptime_service_validation.coordinator import coordinator, db_pool
+from uptime_service_validation.coordinator.coordinator import State, process
+from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.helper import DB, Batch
+
+
+class FakeConnection:
+    "Keeps the writes of the open transaction apart from the committed ones."
+
+    def __init__(self):
+        self.committed = []
+        self.pending = []
+        self.savepoints = {}
+
+    def commit(self):
+        self.committed.extend(self.pending)
+        self.rollback()
+
+    def rollback(self):
+        self.pending = []
+        self.savepoints = {}
+
+
+class FakeDB:
+    "Stands in for DB, failing the write named by fail_at."
+
+    def __init__(self, fail_at=None):
+        self.connection = FakeConnection()
+        self.fail_at = fail_at
+
+    def write(self, name, value=None):
+        if name == self.fail_at:
+            raise psycopg2.DatabaseError(f"{name} failed")
+        self.connection.pending.append((name, value))
+
+    def written(self):
+        return [name for name, _ in self.connection.committed]
+
+    def savepoint(self, name):
+        self.connection.savepoints[name] = len(self.connection.pending)
+
+    def rollback_to_savepoint(self, name):
+        savepoint = self.connection.savepoints[name]
+        del self.connection.pending[savepoint:]
+
+    def create_statehash(self, df):
+        self.write("create_statehash", sorted(df["statehash"]))
+
+    def create_node_record(self, df):
+        self.write("create_node_record", sorted(df["block_producer_key"]))
+
+    def create_bot_log(self, values):
+        self.write("create_bot_log", values)
+        return 42
+
+    def insert_statehash_results(self, df):
+        self.write("insert_statehash_results")
+
+    def create_point_record(self, df):
+        self.write("create_point_record")
+
+    def update_scoreboard(self, score_till_time, uptime_days):
+        self.write("update_scoreboard")
+
+    def insert_submissions(self, submissions):
+        self.write("insert_submissions")
+
+
+class FakeLookups:
+    "Stands in for BatchLookups, with nothing known from previous batches."
+
+    def __init__(self, executor, state):
+        self.state = state
+
+    def result(self):
+        if self.state.known_nodes is None:
+            self.state.known_nodes = set()
+        return (
+            pd.DataFrame(columns=["parent_state_hash", "state_hash"]),
+            pd.DataFrame(columns=["state_hash", "weight"]),
+        )
+
+
+def batch_submissions():
+    submitted_at = datetime(2024, 1, 1, 0, 5, tzinfo=timezone.utc)
+    return pd.DataFrame(
+        {
+            "state_hash": ["sh_1", "sh_1", "sh_2", "sh_2"],
+            "parent": ["sh_0", "sh_0", "sh_1", "sh_1"],
+            "height": [1, 1, 2, 2],
+            "slot": [10, 10, 11, 11],
+            "submitter": ["B62_a", "B62_b", "B62_a", "B62_b"],
+            "submitted_at": [submitted_at] * 4,
+            "created_at": [submitted_at] * 4,
+        }
+    )
+
+
+@pytest.fixture
+def run_batch(monkeypatch):
+    "Process one batch against a FakeDB; return the state."
+    validator_runs = []
+
+    def run_validators(batch, time_intervals):
+        validator_runs.append(batch)
+        return timedelta(seconds=30)
+
+    monkeypatch.setattr(coordinator, "BatchLookups", FakeLookups)
+    monkeypatch.setattr(coordinator, "run_validators", run_validators)
+    monkeypatch.setattr(
+        coordinator,
+        "load_submissions",
+        lambda *args: (batch_submissions(), []),
+    )
+
+    def run(db, state=None):
+        if state is None:
+            state = State(
+                Batch(
+                    start_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+                    bot_log_id=1,
+                    interval=timedelta(minutes=20),
+                )
+            )
+        process(db, state)
+        return state
+
+    run.validator_runs = validator_runs
+    return run
+
+
+def test_process_commits_batch(run_batch):
+    db = FakeDB()
+    state = run_batch(db)
+    assert db.written() == [
+        "create_statehash",
+        "create_node_record",
+        "create_bot_log",
+        "insert_statehash_results",
+        "create_point_record",
+        "update_scoreboard",
+    ]
+    assert db.connection.committed[0] == ("create_statehash", ["sh_0", "sh_1", "sh_2"])
+    assert state.known_nodes == {"B62_a", "B62_b"}
+    assert state.retrials_left == Config.RETRY_COUNT
+    assert state.loop_count == 1
+
+
+def test_process_inserts_every_statehash_and_only_new_nodes(run_batch):
+    db = FakeDB()
+    state = run_batch(db)
+    db.connection.committed = []
+    run_batch(db, state)
+    # statehashes may have been cleaned up meanwhile, so they are always
+    # inserted; nodes are never deleted
+    assert db.written() == [
+        "create_statehash",
+        "create_bot_log",
+        "insert_statehash_results",
+        "create_point_record",
+        "update_scoreboard",
+    ]
+
+
+def test_process_statehash_failure_rolls_back_batch(run_batch):
+    db = FakeDB(fail_at="create_statehash")
+    state = run_batch(db)
+    assert db.written() == []
+    # nothing was committed, so no node became known
+    assert state.known_nodes == set()
+    assert state.retrials_left == Config.RETRY_COUNT - 1
+
+
+def test_process_retries_batch_on_dead_connection(run_batch):
+    db = FakeDB(fail_at="create_statehash")
+
+    def rollback():
+        raise psycopg2.InterfaceError("connection already closed")
+
+    db.connection.rollback = rollback
+    state = run_batch(db)
+    assert db.written() == []
+    assert state.retrials_left == Config.RETRY_COUNT - 1
+    assert not state.stop
+
+
+@pytest.mark.parametrize(
+    "fail_at", ["create_bot_log", "insert_statehash_results", "create_point_record"]
+)
+def test_process_results_failure_keeps_statehashes_and_nodes(run_batch, fail_at):
+    db = FakeDB(fail_at=fail_at)
+    state = run_batch(db)
+    assert db.written() == ["create_statehash", "create_node_record"]
+    # the committed nodes are known
+    assert state.known_nodes == {"B62_a", "B62_b"}
+    assert state.retrials_left == Config.RETRY_COUNT - 1
+
+
+@pytest.mark.parametrize("fail_at", ["update_scoreboard", "insert_submissions"])
+def test_process_scoreboard_failure_keeps_batch_results(
+    run_batch, monkeypatch, fail_at
+):
+    monkeypatch.setattr(Config, "SUBMISSION_STORAGE", Config.STORAGE_CASSANDRA)
+    db = FakeDB(fail_at=fail_at)
+    state = run_batch(db)
+    assert db.written() == [
+        "create_statehash",
+        "create_node_record",
+        "create_bot_log",
+        "insert_statehash_results",
+        "create_point_record",
+    ]
+    assert state.known_nodes == {"B62_a", "B62_b"}
+    # the batch is done, only its scores are missing
+    assert state.retrials_left == Config.RETRY_COUNT
+    assert state.batch.start_time == datetime(2024, 1, 1, 0, 20, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "method, args",
+    [
+        ("create_bot_log", ((0, None, 0, 0, 0),)),
+        ("update_scoreboard", (datetime(2024, 1, 1, tzinfo=timezone.utc),)),
+    ],
+)
+def test_db_writes_reraise_errors(method, args):
+    connection = MagicMock()
+    cursor = connection.cursor.return_value
+    cursor.execute.side_effect = psycopg2.DatabaseError("failed")
+    db = DB(connection, MagicMock())
+    with pytest.raises(psycopg2.DatabaseError):
+        getattr(db, method)(*args)
+    cursor.close.assert_called()
+
+
+def test_retried_batch_skips_validators(run_batch):
+    state = run_batch(FakeDB(fail_at="create_statehash"))
+    assert len(run_batch.validator_runs) == 1
+    assert state.verification_time == timedelta(seconds=30)
+
+    db = FakeDB()
+    run_batch(db, state)
+    # the validators stored their results the first time round
+    assert len(run_batch.validator_runs) == 1
+    assert "create_bot_log" in db.written()
+
+
+def test_advance_to_next_batch_resets_verification_time():
+    state = State(
+        Batch(
+            start_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            bot_log_id=1,
+            interval=timedelta(minutes=20),
+        )
+    )
+    state.verification_time = timedelta(seconds=30)
+    state.advance_to_next_batch(2)
+    assert state.verification_time is None
+    assert state.batch.start_time == datetime(2024, 1, 1, 0, 20, tzinfo=timezone.utc)
+
+
+def test_get_pool_rejects_pool_smaller_than_its_minimum(monkeypatch):
+    monkeypatch.setattr(db_pool, "_pools", {})
+    monkeypatch.setattr(Config, "PG_POOL_MIN", 3)
+    monkeypatch.setattr(Config, "PG_POOL_MAX", 2)
+    with pytest.raises(ValueError):
+        db_pool.get_pool()
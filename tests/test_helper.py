@@ -1,14 +1,21 @@
-from datetime import datetime, timedelta
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
 from uptime_service_validation.coordinator.aws_keyspaces_client import Submission
 import pandas as pd
+import pytest
+from uptime_service_validation.coordinator import helper
 from uptime_service_validation.coordinator.helper import (
     Batch,
     filter_state_hash_percentage,
     create_graph,
     apply_weights,
     bfs,
+    epoch_milliseconds,
+    find_new_values_to_insert,
+    get_contact_details_from_spreadsheet,
+    get_relations,
+    submissions_to_df,
 )
-import calendar
 
 
 def test_get_time_batches():
@@ -165,6 +172,114 @@ def test_array_dataframe():
     )
 
 
+def test_submissions_to_df():
+    submissions = [
+        Submission(
+            "2023-11-06",
+            datetime(2023, 11, 6, 15, 35, 47),
+            "submitter_1",
+            datetime(2023, 11, 6, 15, 35, 48),
+            "block_hash_1",
+            "remote_addr_1",
+            "peer_id_1",
+            3085,
+            "sha_1",
+            state_hash="state_hash_1",
+            parent="parent_1",
+            height=1,
+            slot=2,
+            verified=True,
+        ),
+        Submission(
+            "2023-11-06",
+            datetime(2023, 11, 6, 15, 36, 47),
+            "submitter_2",
+            datetime(2023, 11, 6, 15, 36, 48),
+            "block_hash_2",
+            "remote_addr_2",
+            "peer_id_2",
+            3085,
+            "sha_2",
+            state_hash="state_hash_2",
+            parent="state_hash_1",
+            height=2,
+            slot=3,
+            validation_error="validation_error_2",
+            verified=False,
+        ),
+    ]
+    expected = pd.DataFrame([asdict(submission) for submission in submissions])
+    pd.testing.assert_frame_equal(submissions_to_df(submissions), expected)
+    assert list(submissions_to_df([]).columns) == list(expected.columns)
+    assert submissions_to_df([]).empty
+
+
+def test_contact_details_cached(monkeypatch):
+    monkeypatch.setattr(
+        helper, "_contact_details_cache", {"details": None, "read_at": None}
+    )
+    reads = []
+
+    def read():
+        reads.append(1)
+        if len(reads) > 2:
+            raise RuntimeError("spreadsheet unavailable")
+        return [("discord", "email", f"B62_{len(reads)}")]
+
+    monkeypatch.setattr(helper, "read_contact_details_from_spreadsheet", read)
+    assert get_contact_details_from_spreadsheet() == [("discord", "email", "B62_1")]
+    assert get_contact_details_from_spreadsheet() == [("discord", "email", "B62_1")]
+    assert len(reads) == 1
+
+    # once expired, the spreadsheet is read again
+    helper._contact_details_cache["read_at"] -= (
+        helper.Config.SPREADSHEET_CACHE_TTL_MINUTES * 60
+    )
+    assert get_contact_details_from_spreadsheet() == [("discord", "email", "B62_2")]
+
+    # if it can't be read, the details read last are used
+    helper._contact_details_cache["read_at"] -= (
+        helper.Config.SPREADSHEET_CACHE_TTL_MINUTES * 60
+    )
+    assert get_contact_details_from_spreadsheet() == [("discord", "email", "B62_2")]
+    assert len(reads) == 3
+
+
+def test_contact_details_read_error_without_cache(monkeypatch):
+    monkeypatch.setattr(
+        helper, "_contact_details_cache", {"details": None, "read_at": None}
+    )
+
+    def read():
+        raise RuntimeError("spreadsheet unavailable")
+
+    monkeypatch.setattr(helper, "read_contact_details_from_spreadsheet", read)
+    with pytest.raises(RuntimeError):
+        get_contact_details_from_spreadsheet()
+
+
+def test_find_new_values_to_insert():
+    existing = pd.DataFrame(["state_hash_1", "state_hash_2"], columns=["statehash"])
+    new = pd.DataFrame(
+        ["state_hash_2", "state_hash_3", "state_hash_3", "state_hash_4"],
+        columns=["statehash"],
+    )
+    output = find_new_values_to_insert(existing, new)
+    pd.testing.assert_frame_equal(
+        output, pd.DataFrame(["state_hash_3", "state_hash_4"], columns=["statehash"])
+    )
+
+
+def test_get_relations():
+    df = pd.DataFrame(
+        {
+            "parent_state_hash": ["outside", "a", "a", "b"],
+            "state_hash": ["a", "b", "c", "d"],
+        }
+    )
+    assert list(get_relations(df)) == [("a", "b"), ("a", "c"), ("b", "d")]
+
+
 def test_filter_state_hash_single():
     master_state_hash = pd.DataFrame(
         [["state_hash_1", "block_producer_key_1"]],
@@ -392,13 +507,22 @@ def test_blockchain_epoch():
     state_hash_df = pd.DataFrame(
         ["2021-12-21T10:15:30Z", "2021-12-31T10:15:30Z"], columns=["created_at"]
     )
-    state_hash_df["blockchain_epoch"] = state_hash_df["created_at"].apply(
-        lambda row: int(
-            calendar.timegm(datetime.strptime(row, "%Y-%m-%dT%H:%M:%SZ").timetuple())
-            * 1000
-        )
-    )
+    state_hash_df["blockchain_epoch"] = epoch_milliseconds(state_hash_df["created_at"])
     expected = pd.DataFrame(
         [1640081730000, 1640945730000], columns=["blockchain_epoch"]
     )
     pd.testing.assert_frame_equal(state_hash_df[["blockchain_epoch"]], expected)
+
+
+def test_blockchain_epoch_keeps_milliseconds():
+    created_at = pd.Series(
+        [
+            datetime(2021, 12, 21, 10, 15, 30, 123456, tzinfo=timezone.utc),
+            datetime(2021, 12, 31, 10, 15, 30, tzinfo=timezone.utc),
+        ]
+    )
+    expected = [
+        int(created_at[0].timestamp() * 1000),
+        int(created_at[1].timestamp() * 1000),
+    ]
+    assert epoch_milliseconds(created_at).tolist() == expected
@@ -1,21 +1,113 @@
 import boto3
 import time
 import random
+import threading
 from cassandra import ProtocolVersion
 from cassandra.auth import PlainTextAuthProvider
 from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.concurrent import execute_concurrent_with_args
 from cassandra_sigv4.auth import SigV4AuthProvider
 from cassandra.policies import DCAwareRoundRobinPolicy, RetryPolicy
+from cassandra.query import tuple_factory
+from dataclasses import fields
 from ssl import SSLContext, CERT_REQUIRED, PROTOCOL_TLS_CLIENT
-from datetime import datetime, timedelta
-from typing import Optional, List
-
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
+from typing import Iterable, Literal, Optional, List, Tuple, Union
 import pandas as pd
 
 from uptime_service_validation.coordinator.config import Config
 from uptime_service_validation.coordinator.helper import Submission
 
 
+# Assumed role credentials are refreshed when they are this close to expiring
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+
+# boto3 sessions shared between client instances, with the expiration time
+# of their credentials (None if they don't expire)
+_boto_sessions = {}
+
+
+# Reading and parsing the certificate is only done once per path
+@lru_cache(maxsize=None)
+def _get_ssl_context(certificate_path):
+    ssl_context = SSLContext(PROTOCOL_TLS_CLIENT)
+    ssl_context.load_verify_locations(certificate_path)
+    ssl_context.verify_mode = CERT_REQUIRED
+    ssl_context.check_hostname = False
+    return ssl_context
+
+
+# The same dates recur across consecutive batches, so the result is cached
+@lru_cache(maxsize=256)
+def _submitted_at_dates(start: date, end: date) -> Tuple[str, ...]:
+    return tuple(
+        (start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)
+    )
+
+
+# The query only depends on the keyspace and the shape of the request, which
+# stays the same from one batch to the next, so it is only built once
+@lru_cache(maxsize=32)
+def _submissions_query(
+    keyspace: str,
+    ranged: bool,
+    start_inclusive: bool,
+    end_inclusive: bool,
+    limit: Optional[int],
+) -> str:
+    query = f"""SELECT 
+                submitted_at_date, 
+                submitted_at, 
+                submitter, 
+                created_at, 
+                block_hash, 
+                remote_addr, 
+                peer_id, 
+                graphql_control_port, 
+                built_with_commit_sha, 
+                state_hash, 
+                parent, 
+                height, 
+                slot, 
+                validation_error, 
+                verified 
+               FROM {keyspace}.submissions"""
+
+    if not ranged:
+        if limit is not None:
+            query += f" LIMIT {limit}"
+        return query
+
+    start_operator = ">=" if start_inclusive else ">"
+    end_operator = "<=" if end_inclusive else "<"
+    query += (
+        " WHERE submitted_at_date = ? AND shard IN ?"
+        f" AND submitted_at {start_operator} ? AND submitted_at {end_operator} ?"
+    )
+    if limit is not None:
+        # every (submitted_at_date, shard) partition is capped as well,
+        # so that the coordinator stops reading a partition once it
+        # has produced enough rows. Rows come back in clustering
+        # order; ORDER BY is not used as Cassandra refuses to page
+        # it together with an IN on the partition key.
+        query += f" PER PARTITION LIMIT {limit} LIMIT {limit}"
+    return query
+
+
+def _rows_with_prefetch(result):
+    # Start fetching the next page before handing out the rows of the current
+    # one, so that the network round trip overlaps with processing the rows
+    future = result.response_future
+    rows = result.current_rows
+    while future.has_more_pages:
+        future.start_fetching_next_page()
+        yield from rows
+        rows = future.result().current_rows
+    yield from rows
+
+
 class AWSKeyspacesClient:
     def __init__(self):
         # Load environment variables
@@ -34,8 +126,12 @@ class AWSKeyspacesClient:
         self.aws_secret_access_key = Config.AWS_SECRET_ACCESS_KEY
         self.aws_ssl_certificate_path = Config.SSL_CERTFILE
         self.aws_region = self.cassandra_host.split(".")[1]
-        self.ssl_context = self._create_ssl_context()
+        self.ssl_context = _get_ssl_context(self.aws_ssl_certificate_path)
         self.request_timeout = 20.0
+        self.concurrency = 32
+        # rows are fetched from the server in pages of this size
+        self.fetch_size = 5000
+        self.prepared_statements = {}
 
         if self.cassandra_user and self.cassandra_pass:
             self.auth_provider = PlainTextAuthProvider(
@@ -46,6 +142,7 @@ class AWSKeyspacesClient:
                 # load_balancing_policy=DCAwareRoundRobinPolicy(local_dc=self.aws_region),
                 retry_policy=ExponentialBackOffRetryPolicy(),
                 request_timeout=self.request_timeout,
+                row_factory=tuple_factory,
             )
             self.cluster = Cluster(
                 [self.cassandra_host],
@@ -61,6 +158,7 @@ class AWSKeyspacesClient:
                 load_balancing_policy=DCAwareRoundRobinPolicy(local_dc=self.aws_region),
                 retry_policy=ExponentialBackOffRetryPolicy(),
                 request_timeout=self.request_timeout,
+                row_factory=tuple_factory,
             )
             self.cluster = Cluster(
                 [self.cassandra_host],
@@ -71,17 +169,15 @@ class AWSKeyspacesClient:
                 protocol_version=ProtocolVersion.V4,
             )
 
-    def _create_ssl_context(self):
-        ssl_context = SSLContext(PROTOCOL_TLS_CLIENT)
-        ssl_context.load_verify_locations(self.aws_ssl_certificate_path)
-        ssl_context.verify_mode = CERT_REQUIRED
-        ssl_context.check_hostname = False
-        return ssl_context
-
     def _using_assumed_role(self):
         return self.role_arn is not None and self.role_arn != ""
 
     def _create_sigv4auth_provider(self):
+        return RefreshingSigV4AuthProvider(self._get_boto_session)
+
+    def _get_boto_session(self):
+        # boto3 sessions are shared between clients; sessions with assumed role
+        # credentials are recreated when the credentials are about to expire
         if self._using_assumed_role():
             if not self.web_identity_token_file:
                 raise ValueError(
@@ -91,7 +187,20 @@ class AWSKeyspacesClient:
                 raise ValueError(
                     "AWS_ROLE_SESSION_NAME environment variable is not set"
                 )
+            key = (self.role_arn, self.role_session_name, self.aws_region)
+        else:
+            key = (self.aws_access_key_id, self.aws_region)
+
+        cached = _boto_sessions.get(key)
+        if cached is not None:
+            boto_session, expiration = cached
+            if (
+                expiration is None
+                or expiration - datetime.now(timezone.utc) > CREDENTIALS_REFRESH_MARGIN
+            ):
+                return boto_session
 
+        if self._using_assumed_role():
             with open(self.web_identity_token_file, "r") as file:
                 web_identity_token = file.read().strip()
 
@@ -108,40 +217,76 @@ class AWSKeyspacesClient:
                 aws_session_token=credentials["SessionToken"],
                 region_name=self.aws_region,
             )
+            expiration = credentials["Expiration"]
         else:
             boto_session = boto3.Session(
                 aws_access_key_id=self.aws_access_key_id,
                 aws_secret_access_key=self.aws_secret_access_key,
                 region_name=self.aws_region,
             )
-        return SigV4AuthProvider(boto_session)
+            expiration = None
+        _boto_sessions[key] = (boto_session, expiration)
+        return boto_session
+
+    def refresh_credentials(self):
+        # Connections the driver opens later on are authenticated with the
+        # session of the auth provider; renewing expiring credentials here
+        # keeps the STS calls off the driver's connection threads
+        if isinstance(self.auth_provider, RefreshingSigV4AuthProvider):
+            self.auth_provider.refresh()
 
     def connect(self):
+        self.refresh_credentials()
         self.session = self.cluster.connect()
+        self.session.default_fetch_size = self.fetch_size
 
     def execute_query(self, query, parameters=None):
+        self.refresh_credentials()
         if parameters:
             return self.session.execute(query, parameters)
         else:
             return self.session.execute(query)
 
+    def prepare(self, query):
+        # Prepared statements are cached, so that each query is only prepared once
+        if query not in self.prepared_statements:
+            self.prepared_statements[query] = self.session.prepare(query)
+        return self.prepared_statements[query]
+
+    def execute_concurrent_query(self, query, parameters_list):
+        # Runs the prepared query once for each set of parameters,
+        # with up to self.concurrency requests in flight. Rows are yielded
+        # as the driver pages through the results.
+        self.refresh_credentials()
+        results = execute_concurrent_with_args(
+            self.session,
+            self.prepare(query),
+            parameters_list,
+            concurrency=self.concurrency,
+            raise_on_first_error=True,
+            results_generator=True,
+        )
+        for _, result in results:
+            yield from _rows_with_prefetch(result)
+
     # get list of submitted_at_date in the form of [YYYY-MM-DD]
     # submitted_at_date is needed, along with start_date and end_date, as input to get list of submissions from Cassandra AWS Keyspace
     @staticmethod
     def get_submitted_at_date_list(
         start_date: datetime, end_date: datetime
     ) -> List[str]:
-        submitted_at_date_start = start_date.date()
-        submitted_at_date_end = end_date.date()
-        if submitted_at_date_start == submitted_at_date_end:
-            submitted_at_dates = [submitted_at_date_start.strftime("%Y-%m-%d")]
-        else:
-            submitted_at_dates = (
-                pd.date_range(submitted_at_date_start, submitted_at_date_end)
-                .map(lambda x: x.date().strftime("%Y-%m-%d"))
-                .to_list()
+        return list(_submitted_at_dates(start_date.date(), end_date.date()))
+
+    @classmethod
+    def _range_parameters(cls, submitted_at_start, submitted_at_end):
+        # Bound values of the queries for every submitted_at_date in the range
+        shards = ShardCalculator.shards_tuple(submitted_at_start, submitted_at_end)
+        return [
+            (submitted_at_date, shards, submitted_at_start, submitted_at_end)
+            for submitted_at_date in cls.get_submitted_at_date_list(
+                submitted_at_start, submitted_at_end
             )
-        return submitted_at_dates
+        ]
 
     def get_submissions(
         self,
@@ -150,7 +295,14 @@ class AWSKeyspacesClient:
         submitted_at_end: Optional[datetime] = None,
         start_inclusive: bool = True,
         end_inclusive: bool = False,
-    ) -> List[Submission]:
+        return_as: Literal["iterator", "list", "pandas"] = "iterator",
+    ) -> Union[Iterable[Submission], pd.DataFrame]:
+        # Submissions are streamed as the results are paged in from the server
+        # by default. With return_as="list" they are collected into a list, and
+        # with return_as="pandas" the rows are loaded into a DataFrame with the
+        # columns of Submission, without creating Submission instances.
+        if return_as not in ("iterator", "list", "pandas"):
+            raise ValueError(f"Invalid return_as: {return_as}")
         # you have to provide either both submitted_at_start and submitted_at_end or neither
         if (submitted_at_start and not submitted_at_end) or (
             not submitted_at_start and submitted_at_end
@@ -159,106 +311,95 @@ class AWSKeyspacesClient:
                 "You have to provide either both submitted_at_start and submitted_at_end or neither"
             )
 
-        base_query = f"""SELECT 
-                        submitted_at_date, 
-                        submitted_at, 
-                        submitter, 
-                        created_at, 
-                        block_hash, 
-                        remote_addr, 
-                        peer_id, 
-                        graphql_control_port, 
-                        built_with_commit_sha, 
-                        state_hash, 
-                        parent, 
-                        height, 
-                        slot, 
-                        validation_error, 
-                        verified 
-                       FROM {self.aws_keyspace}.submissions"""
-
-        # For storing conditions and corresponding parameters
-        conditions = []
-        parameters = []
-
-        # Getting submitted_at_date list
         if submitted_at_start and submitted_at_end:
-            submitted_at_date_list = self.get_submitted_at_date_list(
-                submitted_at_start, submitted_at_end
+            # submitted_at_date is the partition key, so instead of a single
+            # IN query, every date is queried separately and concurrently.
+            # All values are bound, so the same prepared statement is reused
+            # across batches.
+            results = self.execute_concurrent_query(
+                _submissions_query(
+                    self.aws_keyspace, True, start_inclusive, end_inclusive, limit
+                ),
+                self._range_parameters(submitted_at_start, submitted_at_end),
             )
-
-            shard_condition = ShardCalculator.calculate_shards_in_range(
-                submitted_at_start, submitted_at_end
+            if limit is not None:
+                results = islice(results, limit)
+        else:
+            results = self.execute_query(
+                _submissions_query(self.aws_keyspace, False, True, False, limit)
             )
 
-            if len(submitted_at_date_list) == 1:
-                submitted_at_date = submitted_at_date_list[0]
-            else:
-                submitted_at_date = None
-                submitted_at_dates = ",".join(
-                    [
-                        f"'{submitted_at_date}'"
-                        for submitted_at_date in submitted_at_date_list
-                    ]
-                )
-            # Adding conditions based on provided parameters
-            if submitted_at_date:
-                conditions.append("submitted_at_date = %s")
-                parameters.append(submitted_at_date)
-            elif submitted_at_dates:
-                conditions.append(f"submitted_at_date IN ({submitted_at_dates})")
-
-            # Add shard condition here since we have a submitted_at_date or submitted_at_dates
-            conditions.append(shard_condition)
-
-            if submitted_at_start:
-                start_operator = ">=" if start_inclusive else ">"
-                conditions.append(f"submitted_at {start_operator} %s")
-                parameters.append(submitted_at_start)
-            if submitted_at_end:
-                end_operator = "<=" if end_inclusive else "<"
-                conditions.append(f"submitted_at {end_operator} %s")
-                parameters.append(submitted_at_end)
-
-        # Constructing the final query
-        if conditions:
-            query = f"{base_query} WHERE {' AND '.join(conditions)}"
-        else:
-            query = base_query
+        return self._map_rows(results, return_as)
 
-        if limit is not None:
-            query += f" LIMIT {limit}"
+    def get_submissions_in_intervals(
+        self,
+        time_intervals: Iterable[Tuple[datetime, datetime]],
+        start_inclusive: bool = True,
+        end_inclusive: bool = False,
+        return_as: Literal["iterator", "list", "pandas"] = "iterator",
+    ) -> Union[Iterable[Submission], pd.DataFrame]:
+        # Same as calling get_submissions for every interval one after the
+        # other, but the queries of all the intervals are executed concurrently.
+        # Submissions come out in the order of the intervals.
+        if return_as not in ("iterator", "list", "pandas"):
+            raise ValueError(f"Invalid return_as: {return_as}")
+
+        results = self.execute_concurrent_query(
+            _submissions_query(
+                self.aws_keyspace, True, start_inclusive, end_inclusive, None
+            ),
+            [
+                parameters
+                for submitted_at_start, submitted_at_end in time_intervals
+                for parameters in self._range_parameters(
+                    submitted_at_start, submitted_at_end
+                )
+            ],
+        )
+        return self._map_rows(results, return_as)
 
-        # Executing the query with parameters
-        results = self.execute_query(query, parameters)
+    @staticmethod
+    def _map_rows(results, return_as):
+        # Rows are plain tuples in the order of the selected columns;
+        # snark_work is not selected, so it is filled in with None.
+        if return_as == "pandas":
+            columns = [field.name for field in fields(Submission)]
+            df = pd.DataFrame.from_records(
+                results, columns=columns[:9] + columns[10:]
+            )
+            df.insert(9, "snark_work", None)
+            return df
 
         # Mapping results to Submission dataclass instances
-        submissions = [
-            Submission(
-                submitted_at_date=row.submitted_at_date,
-                submitted_at=row.submitted_at,
-                submitter=row.submitter,
-                created_at=row.created_at,
-                block_hash=row.block_hash,
-                remote_addr=row.remote_addr,
-                peer_id=row.peer_id,
-                graphql_control_port=row.graphql_control_port,
-                built_with_commit_sha=row.built_with_commit_sha,
-                state_hash=row.state_hash,
-                parent=row.parent,
-                height=row.height,
-                slot=row.slot,
-                validation_error=row.validation_error,
-                verified=row.verified,
-            )
-            for row in results
-        ]
-        return submissions
+        submissions = (Submission(*row[:9], None, *row[9:]) for row in results)
+        return list(submissions) if return_as == "list" else submissions
 
     def close(self):
         self.cluster.shutdown()
 
 
+class RefreshingSigV4AuthProvider(SigV4AuthProvider):
+    # The client is kept for the lifetime of the coordinator, so connections
+    # opened later on are authenticated with the boto3 session of the last
+    # refresh rather than the one the cluster was created with, whose
+    # credentials may have expired in the meantime. Refreshing is left to the
+    # client, as it may call STS; the driver opens connections from several
+    # threads, so the session is swapped under a lock.
+    def __init__(self, get_session):
+        self._get_session = get_session
+        self._lock = threading.Lock()
+        super().__init__(get_session())
+
+    def refresh(self):
+        session = self._get_session()
+        with self._lock:
+            self.session = session
+
+    def new_authenticator(self, host):
+        with self._lock:
+            return super().new_authenticator(host)
+
+
 class ExponentialBackOffRetryPolicy(RetryPolicy):
     def __init__(self, base_delay=0.1, max_delay=10, max_retries=10):
         self.base_delay = base_delay  # seconds
@@ -310,37 +451,74 @@ class ExponentialBackOffRetryPolicy(RetryPolicy):
 
 
 class ShardCalculator:
+    SECONDS_PER_SHARD = 144
+    SHARDS_PER_DAY = 86400 // SECONDS_PER_SHARD
+
     @classmethod
     def calculate_shard(cls, hour, minute, second):
-        return (3600 * hour + 60 * minute + second) // 144
+        return (3600 * hour + 60 * minute + second) // cls.SECONDS_PER_SHARD
 
     @classmethod
-    def calculate_shards_in_range(cls, start_time, end_time):
-        shards = set()
-        current_time = start_time
+    def shard_mask(cls, first_shard, last_shard):
+        # Bitmap with the bits of shards first_shard..last_shard (inclusive) set
+        return ((1 << (last_shard - first_shard + 1)) - 1) << first_shard
 
-        while current_time < end_time:
-            shard = cls.calculate_shard(
-                current_time.hour, current_time.minute, current_time.second
-            )
-            shards.add(shard)
-            # Move to the next second
-            current_time += timedelta(seconds=1)
-
-        # Check if endTime falls exactly on a new shard boundary and add it if necessary
-        end_shard = cls.calculate_shard(end_time.hour, end_time.minute, end_time.second)
-        if end_shard not in shards:
-            # Check if end_time is exactly on the boundary of a new shard
-            total_seconds_end = (
-                (end_time.hour * 3600) + (end_time.minute * 60) + end_time.second
-            )
-            if total_seconds_end % 144 == 0:
-                shards.add(end_shard)
+    @classmethod
+    def shards_in_range(cls, start_time, end_time):
+        return list(cls.shards_tuple(start_time, end_time))
 
-        # Convert the set of unique shards into a sorted list for readability
-        shards_list = sorted(list(shards))
+    @classmethod
+    def shards_tuple(cls, start_time, end_time):
+        # The shards only depend on the time of day of start_time and the
+        # length of the range, which is the same for consecutive batches
+        start_of_day = timedelta(
+            hours=start_time.hour,
+            minutes=start_time.minute,
+            seconds=start_time.second,
+            microseconds=start_time.microsecond,
+        )
+        return cls._shards_tuple(start_of_day, end_time - start_time)
+
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _shards_tuple(cls, start_of_day, duration):
+        day = timedelta(days=1)
+        shard_length = timedelta(seconds=cls.SECONDS_PER_SHARD)
+        # The set of shards is kept as a bitmap, bit n standing for shard n
+        shards = 0
+
+        if duration >= day:
+            # The range covers every shard of the day
+            shards = cls.shard_mask(0, cls.SHARDS_PER_DAY - 1)
+        elif duration > timedelta(0):
+            # The range is half-open, so the last covered instant is just before the end
+            last_of_day = start_of_day + duration - timedelta(microseconds=1)
+            start_shard = start_of_day // shard_length
+            if last_of_day < day:
+                shards = cls.shard_mask(start_shard, last_of_day // shard_length)
+            else:
+                # Shards start again from 0 after midnight
+                shards = cls.shard_mask(
+                    start_shard, cls.SHARDS_PER_DAY - 1
+                ) | cls.shard_mask(0, (last_of_day - day) // shard_length)
+
+        # Check if the end falls exactly on a new shard boundary and add it if necessary
+        total_seconds_end = ((start_of_day + duration) % day).seconds
+        if total_seconds_end % cls.SECONDS_PER_SHARD == 0:
+            shards |= 1 << (total_seconds_end // cls.SECONDS_PER_SHARD)
+
+        # Extract the shards from the lowest bit up, so they come out sorted
+        shards_list = []
+        while shards:
+            lowest_bit = shards & -shards
+            shards_list.append(lowest_bit.bit_length() - 1)
+            shards ^= lowest_bit
+        return tuple(shards_list)
+
+    @classmethod
+    def calculate_shards_in_range(cls, start_time, end_time):
         # Format the shards into a CQL statement string
-        shards_list = sorted(list(shards))  # Sort the shards for readability
+        shards_list = cls.shards_in_range(start_time, end_time)
         shards_str = ",".join(map(str, shards_list))
         cql_statement = f"shard in ({shards_str})"
         return cql_statement
@@ -353,7 +531,7 @@ if __name__ == "__main__":
         client.connect()
 
         print("All submissions:")
-        submissions = client.get_submissions()
+        submissions = client.get_submissions(return_as="list")
         print("Number of submissions:", len(submissions))
         print()
 
@@ -365,6 +543,7 @@ if __name__ == "__main__":
             submitted_at_end=end,
             start_inclusive=True,
             end_inclusive=False,
+            return_as="list",
         )
         for submission in submissions:
             print(submission.submitter, submission.submitted_at, submission.block_hash)
@@ -1,4 +1,34 @@
+from dataclasses import dataclass, field
 import os
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class PostgresConfig:
+    """
+    Connection settings for the Postgres database.
+    """
+
+    host: str
+    port: int
+    db: str
+    user: str
+    password: str = field(repr=False)
+
+    def connection_params(self, dbname: Optional[str] = None):
+        """
+        Returns the keyword arguments for connecting with psycopg2.
+
+        :param dbname: The database to connect to, defaults to the configured one.
+        :return: A dictionary of connection parameters.
+        """
+        return {
+            "host": self.host,
+            "port": self.port,
+            "dbname": dbname or self.db,
+            "user": self.user,
+            "password": self.password,
+        }
 
 
 class Config:
@@ -21,9 +51,14 @@ class Config:
     AWS_REGION = os.environ.get("AWS_REGION")
 
     # Slack Alerts
-    WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
-    ALARM_ZK_LOWER_LIMIT_SEC = os.environ.get("ALARM_ZK_LOWER_LIMIT_SEC")
-    ALARM_ZK_UPPER_LIMIT_SEC = os.environ.get("ALARM_ZK_UPPER_LIMIT_SEC")
+    WEBHOOK_URL = os.environ.get("WEBHOOK_URL") or None
+    # unset limits never raise an alarm
+    ALARM_ZK_LOWER_LIMIT_SEC = float(
+        os.environ.get("ALARM_ZK_LOWER_LIMIT_SEC") or "-inf"
+    )
+    ALARM_ZK_UPPER_LIMIT_SEC = float(
+        os.environ.get("ALARM_ZK_UPPER_LIMIT_SEC") or "inf"
+    )
 
     # Submission Storage
     STORAGE_CASSANDRA = "CASSANDRA"
@@ -37,6 +72,17 @@ class Config:
     POSTGRES_USER = os.environ["POSTGRES_USER"]
     POSTGRES_PASSWORD = os.environ["POSTGRES_PASSWORD"]
     POSTGRES_PORT = os.environ["POSTGRES_PORT"]
+    POSTGRES = PostgresConfig(
+        host=POSTGRES_HOST,
+        port=int(POSTGRES_PORT),
+        db=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+    )
+    POSTGRES_RO_USER = os.environ.get("POSTGRES_RO_USER")
+    POSTGRES_RO_PASSWORD = os.environ.get("POSTGRES_RO_PASSWORD")
+    PG_POOL_MIN = int(os.environ.get("PG_POOL_MIN", "3"))
+    PG_POOL_MAX = int(os.environ.get("PG_POOL_MAX", "10"))
 
     # Cassandra / Keyspaces
     AWS_KEYSPACE = os.environ.get("AWS_KEYSPACE")
@@ -60,6 +106,9 @@ class Config:
     SPREADSHEET_CREDENTIALS_JSON = str(
         os.environ.get("SPREADSHEET_CREDENTIALS_JSON")
     ).strip()
+    SPREADSHEET_CACHE_TTL_MINUTES = int(
+        os.environ.get("SPREADSHEET_CACHE_TTL_MINUTES", "60")
+    )
     SPREADSHEET_SCOPE = [
         "https://spreadsheets.google.com/feeds",
         "https://www.googleapis.com/auth/drive",
@@ -3,7 +3,7 @@ the validator processes, distribute work them and, when they're done,
 collect their results, compute scores for the delegation program and
 put the results in the database."""
 
-from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 import logging
 import os
@@ -14,17 +14,19 @@ from dotenv import load_dotenv
 import pandas as pd
 import psycopg2
 from uptime_service_validation.coordinator.config import Config
+from uptime_service_validation.coordinator.db_pool import get_conn
 from uptime_service_validation.coordinator.helper import (
     DB,
     Timer,
+    epoch_milliseconds,
     get_relations,
-    find_new_values_to_insert,
     filter_state_hash_percentage,
     create_graph,
     apply_weights,
     bfs,
     send_slack_message,
     get_contact_details_from_spreadsheet,
+    submissions_to_df,
 )
 from uptime_service_validation.coordinator.server import (
     setUpValidatorPods,
@@ -38,6 +40,18 @@ from uptime_service_validation.coordinator.aws_keyspaces_client import (
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 sys.path.insert(0, project_root)
 
+# Set once the statehashes and nodes of a batch are inserted; failing to store
+# the batch results only rolls back to here
+BATCH_RESULTS_SAVEPOINT = "batch_results"
+# Set once the results of a batch are stored; failing to update the scores
+# only rolls back to here
+SCOREBOARD_SAVEPOINT = "scoreboard"
+# Lookups running in the background while a batch is processed, each on a
+# pooled connection of its own
+LOOKUP_WORKERS = 2
+# Pooled connections a batch uses at once: its own and those of the lookups
+DB_CONNECTIONS_PER_BATCH = LOOKUP_WORKERS + 1
+
 
 class State:
     """The state aggregates all the data that remains constant while processing
@@ -52,6 +66,12 @@ class State:
         self.interval = Config.SURVEY_INTERVAL_MINUTES
         self.loop_count = 0
         self.stop = False
+        # block producers known to be in the database; loaded once and then
+        # extended with what every batch commits
+        self.known_nodes = None
+        # how long the validators took on the current batch; None until they
+        # ran on it
+        self.verification_time = None
 
     def wait_until_batch_ends(self):
         "If the time window if the current batch is not yet over, sleep until it is."
@@ -73,6 +93,7 @@ class State:
         transitioning the state to the next loop pass."""
         self.retrials_left = Config.RETRY_COUNT
         self.batch = self.batch.next(next_bot_log_id)
+        self.verification_time = None
         self.__warn_if_work_took_longer_then_expected()
         self.__next_loop()
         self.__update_timestamp()
@@ -110,33 +131,38 @@ class State:
             )
 
 
-def load_submissions(time_intervals, db, submission_storage=Config.SUBMISSION_STORAGE):
+def load_submissions(
+    time_intervals, db, submission_storage=Config.SUBMISSION_STORAGE, cassandra=None
+):
     """
     Load submissions from Config.SUBMISSION_STORAGE:
      - return validated subs as a DataFrame for further processing.
      - return all subs for storing in the submissions_by_submitter table.
+    A connected AWSKeyspacesClient can be passed in to be reused across
+    batches; otherwise a client is connected for this call only.
     """
     submissions = []
-    submissions_verified = []
 
     if submission_storage == Config.STORAGE_CASSANDRA:
-        cassandra = AWSKeyspacesClient()
+        owns_client = cassandra is None
+        if owns_client:
+            cassandra = AWSKeyspacesClient()
         try:
-            cassandra.connect()
-            for time_interval in time_intervals:
-                submissions.extend(
-                    cassandra.get_submissions(
-                        submitted_at_start=time_interval[0],
-                        submitted_at_end=time_interval[1],
-                        start_inclusive=True,
-                        end_inclusive=False,
-                    )
+            if owns_client:
+                cassandra.connect()
+            submissions.extend(
+                cassandra.get_submissions_in_intervals(
+                    time_intervals,
+                    start_inclusive=True,
+                    end_inclusive=False,
                 )
+            )
         except Exception as e:
             logging.error("Error in loading submissions: %s", e)
             return [pd.DataFrame([]), submissions]
         finally:
-            cassandra.close()
+            if owns_client:
+                cassandra.close()
     elif submission_storage == Config.STORAGE_POSTGRES:
         start_date = time_intervals[0][0]
         end_date = time_intervals[-1][1]
@@ -154,11 +180,11 @@ def load_submissions(time_intervals, db, submission_storage=Config.SUBMISSION_ST
 
     # for further processing
     # we use only submissions verified = True and validation_error = None or ""
-    for submission in submissions:
-        if submission.verified and (
-            submission.validation_error is None or submission.validation_error == ""
-        ):
-            submissions_verified.append(submission)
+    submissions_verified = [
+        submission
+        for submission in submissions
+        if submission.verified and submission.validation_error in (None, "")
+    ]
 
     all_submissions_count = len(submissions)
     submissions_to_process_count = len(submissions_verified)
@@ -169,70 +195,90 @@ def load_submissions(time_intervals, db, submission_storage=Config.SUBMISSION_ST
             "some submissions were not processed, because they were not verified or had validation errors"
         )
     return [
-        pd.DataFrame([asdict(submission) for submission in submissions_verified]),
+        submissions_to_df(submissions_verified),
         submissions,
     ]
 
 
-def process_statehash_df(db, batch, state_hash_df, verification_time):
-    """Process the state hash dataframe and return the master dataframe."""
+def process_statehash_df(
+    db,
+    batch,
+    state_hash_df,
+    verification_time,
+    known_nodes,
+    previous_statehash=None,
+):
+    """Process the state hash dataframe and store the results of the batch.
+    Return the id of the new bot log and the block producers inserted, which
+    become known once the transaction is committed. The result of the
+    previous batch, as returned by db.get_previous_statehash, can be passed
+    in if it was already fetched."""
     all_files_count = state_hash_df.shape[0]
-    master_df = pd.DataFrame()
-    master_df["state_hash"] = state_hash_df["state_hash"]
-    master_df["blockchain_height"] = state_hash_df["height"]
-    master_df["slot"] = pd.to_numeric(state_hash_df["slot"])
-    master_df["parent_state_hash"] = state_hash_df["parent"]
-    master_df["submitter"] = state_hash_df["submitter"]
-    master_df["file_updated"] = state_hash_df["submitted_at"]
-    master_df["file_name"] = (
-        state_hash_df["submitted_at"].astype(str)
-        + "-"
-        + state_hash_df["submitter"].astype(str)
-    )  # Perhaps this should be changed? Filename makes less sense now.
-    master_df["blockchain_epoch"] = state_hash_df["created_at"].apply(
-        lambda row: int(row.timestamp() * 1000)
+    # the time the records of this batch are created at
+    now = datetime.now(timezone.utc)
+    # Statehashes and submitters repeat a lot within a batch, so they are kept
+    # as categoricals. Both statehash columns share the same categories: the
+    # distinct statehashes of the batch.
+    state_hash_dtype = pd.CategoricalDtype(
+        pd.concat(
+            [state_hash_df["state_hash"], state_hash_df["parent"]], ignore_index=True
+        )
+        .dropna()
+        .unique()
     )
-
-    state_hash = pd.unique(
-        master_df[["state_hash", "parent_state_hash"]].values.ravel("k")
+    master_df = pd.DataFrame(
+        {
+            "state_hash": state_hash_df["state_hash"].astype(state_hash_dtype),
+            "blockchain_height": state_hash_df["height"],
+            "slot": state_hash_df["slot"],
+            "parent_state_hash": state_hash_df["parent"].astype(state_hash_dtype),
+            "block_producer_key": state_hash_df["submitter"].astype("category"),
+            "file_timestamps": state_hash_df["submitted_at"],
+            # Perhaps this should be changed? Filename makes less sense now.
+            "file_name": state_hash_df["submitted_at"]
+            .astype(str)
+            .str.cat(state_hash_df["submitter"].astype(str), sep="-"),
+            "blockchain_epoch": epoch_milliseconds(state_hash_df["created_at"]),
+        }
     )
-    existing_state_df = db.get_statehash_df()
-    existing_nodes = db.get_existing_nodes()
-    logging.info("number of nodes in the previous batch: %s", len(existing_nodes))
-    state_hash_to_insert = find_new_values_to_insert(
-        existing_state_df, pd.DataFrame(state_hash, columns=["statehash"])
+
+    # All the statehashes of the batch are inserted, skipping those already
+    # stored. Caching them is not safe: cleanup_old_data deletes the
+    # unreferenced ones while the coordinator runs.
+    state_hash_to_insert = pd.DataFrame(
+        state_hash_dtype.categories, columns=["statehash"]
     )
-    logging.info("number of statehashes to insert: %s", len(state_hash_to_insert))
+    logging.info("number of statehashes in the batch: %s", len(state_hash_to_insert))
     if not state_hash_to_insert.empty:
         db.create_statehash(state_hash_to_insert)
 
-    nodes_in_cur_batch = pd.DataFrame(
-        master_df["submitter"].unique(), columns=["block_producer_key"]
-    )
+    # the categories of the submitters are exactly the distinct submitters
+    logging.info("number of nodes in the previous batch: %s", len(known_nodes))
+    nodes_in_cur_batch = master_df["block_producer_key"].cat.categories
     logging.info("number of nodes in the current batch: %s", len(nodes_in_cur_batch))
 
-    node_to_insert = find_new_values_to_insert(existing_nodes, nodes_in_cur_batch)
+    node_to_insert = pd.DataFrame(
+        [n for n in nodes_in_cur_batch if n not in known_nodes],
+        columns=["block_producer_key"],
+    )
     logging.info("number of nodes to insert: %s", len(node_to_insert))
 
     if not node_to_insert.empty:
-        node_to_insert["updated_at"] = datetime.now(timezone.utc)
-        db.create_node_record(node_to_insert, 100)
-
-    master_df.rename(
-        inplace=True,
-        columns={
-            "file_updated": "file_timestamps",
-            "submitter": "block_producer_key",
-        },
-    )
+        db.create_node_record(node_to_insert.assign(updated_at=now))
 
-    relation_df, p_selected_node_df = db.get_previous_statehash(batch.bot_log_id)
+    if previous_statehash is None:
+        previous_statehash = db.get_previous_statehash(batch.bot_log_id)
+    relation_df, p_selected_node_df = previous_statehash
 
     p_map = list(get_relations(relation_df))
     c_selected_node = filter_state_hash_percentage(master_df)
 
+    # Many block producers submit the same blocks; the graph only needs every
+    # (statehash, parent) relation once.
+    edges_df = master_df[["state_hash", "parent_state_hash"]].drop_duplicates()
+
     logging.info("creating graph for the current batch...")
-    batch_graph = create_graph(master_df, p_selected_node_df, c_selected_node, p_map)
+    batch_graph = create_graph(edges_df, p_selected_node_df, c_selected_node, p_map)
     logging.info("graph created successfully.")
 
     logging.info("applying weights to the graph...")
@@ -243,8 +289,12 @@ def process_statehash_df(db, batch, state_hash_df, verification_time):
     )
     logging.info("weights applied successfully.")
 
-    queue_list = list(p_selected_node_df["state_hash"].values) + c_selected_node
-    batch_state_hash = list(master_df["state_hash"].unique())
+    queue_list = p_selected_node_df["state_hash"].tolist() + c_selected_node
+    # the categories are shared with the parents, so only the codes in use
+    # by state_hash are the statehashes of the batch
+    batch_state_hash = frozenset(
+        master_df["state_hash"].cat.remove_unused_categories().cat.categories
+    )
 
     logging.info("running BFS on the graph...")
     shortlisted_state_hash_df = bfs(
@@ -255,23 +305,28 @@ def process_statehash_df(db, batch, state_hash_df, verification_time):
         # but it's not used anywhere inside the function)
     )
     logging.info("BFS completed successfully.")
+    # compared as category codes; shortlisted statehashes that aren't in the
+    # batch get no code (-1) and are left out
+    shortlisted_codes = state_hash_dtype.categories.get_indexer(
+        shortlisted_state_hash_df["state_hash"]
+    )
+    shortlisted_codes = shortlisted_codes[shortlisted_codes >= 0]
     point_record_df = master_df[
-        master_df["state_hash"].isin(shortlisted_state_hash_df["state_hash"].values)
+        master_df["state_hash"].cat.codes.isin(shortlisted_codes)
     ]
 
-    for index, row in shortlisted_state_hash_df.iterrows():
-        if not row["state_hash"] in batch_state_hash:
-            shortlisted_state_hash_df.drop(index, inplace=True, axis=0)
-    p_selected_node_df = shortlisted_state_hash_df.copy()
-    parent_hash = []
-    for s in shortlisted_state_hash_df["state_hash"].values:
-        p_hash = master_df[master_df["state_hash"] == s]["parent_state_hash"].values[0]
-        parent_hash.append(p_hash)
-    shortlisted_state_hash_df["parent_state_hash"] = parent_hash
-
-    p_map = list(
-        get_relations(shortlisted_state_hash_df[["parent_state_hash", "state_hash"]])
-    )
+    # keep only the statehashes of the current batch
+    shortlisted_state_hash_df = shortlisted_state_hash_df[
+        shortlisted_state_hash_df["state_hash"].isin(batch_state_hash)
+    ].copy()
+    # parent of every statehash, as given by its first submission in the batch
+    parent_map = master_df.drop_duplicates("state_hash").set_index("state_hash")[
+        "parent_state_hash"
+    ]
+    shortlisted_state_hash_df["parent_state_hash"] = shortlisted_state_hash_df[
+        "state_hash"
+    ].map(parent_map)
+
     if not point_record_df.empty:
         file_timestamp = master_df.iloc[-1]["file_timestamps"]
     else:
@@ -289,50 +344,77 @@ def process_statehash_df(db, batch, state_hash_df, verification_time):
         batch.end_time.timestamp(),
         verification_time.total_seconds(),
     )
-    bot_log_id = db.create_bot_log(values)
+    # If storing the results fails, the statehashes and nodes are committed
+    # anyway, so that retrying the batch doesn't have to insert them again
+    db.savepoint(BATCH_RESULTS_SAVEPOINT)
+    try:
+        bot_log_id = db.create_bot_log(values)
 
-    shortlisted_state_hash_df["bot_log_id"] = bot_log_id
-    db.insert_statehash_results(shortlisted_state_hash_df)
+        db.insert_statehash_results(
+            shortlisted_state_hash_df.assign(bot_log_id=bot_log_id)
+        )
 
-    if not point_record_df.empty:
-        point_record_df = point_record_df.copy()
-        point_record_df.loc[:, "amount"] = 1
-        point_record_df.loc[:, "created_at"] = datetime.now(timezone.utc)
-        point_record_df.loc[:, "bot_log_id"] = bot_log_id
-        point_record_df = point_record_df[
-            [
-                "file_name",
-                "file_timestamps",
-                "blockchain_epoch",
-                "block_producer_key",
-                "blockchain_height",
-                "amount",
-                "created_at",
-                "bot_log_id",
-                "state_hash",
+        if not point_record_df.empty:
+            point_record_df = point_record_df.assign(
+                amount=1,
+                created_at=now,
+                bot_log_id=bot_log_id,
+            )[
+                [
+                    "file_name",
+                    "file_timestamps",
+                    "blockchain_epoch",
+                    "block_producer_key",
+                    "blockchain_height",
+                    "amount",
+                    "created_at",
+                    "bot_log_id",
+                    "state_hash",
+                ]
             ]
-        ]
-        db.create_point_record(point_record_df)
-    return bot_log_id
+            db.create_point_record(point_record_df)
+    except Exception:
+        db.rollback_to_savepoint(BATCH_RESULTS_SAVEPOINT)
+        db.connection.commit()
+        known_nodes.update(node_to_insert["block_producer_key"])
+        raise
+    return bot_log_id, node_to_insert["block_producer_key"].tolist()
+
+
+def query_db(method, *args):
+    """Call a DB method on a connection of its own, borrowed from the pool,
+    so that queries can run concurrently."""
+    with get_conn() as connection:
+        return method(DB(connection, logging), *args)
+
+
+class BatchLookups:
+    """The database lookups of a batch that don't depend on its submissions:
+    the known block producers (unless the state already has them) and the
+    result of the previous batch. They run concurrently in the background,
+    each on a connection of its own."""
+
+    def __init__(self, executor, state):
+        self.state = state
+        self.nodes = None
+        if state.known_nodes is None:
+            self.nodes = executor.submit(query_db, DB.get_existing_nodes)
+        self.previous_statehash = executor.submit(
+            query_db, DB.get_previous_statehash, state.batch.bot_log_id
+        )
 
+    def result(self):
+        """Wait for the lookups, load the known values into the state and
+        return the result of the previous batch, as returned by
+        DB.get_previous_statehash. Errors of the lookups are re-raised."""
+        if self.nodes is not None:
+            self.state.known_nodes = set(self.nodes.result()["block_producer_key"])
+        return self.previous_statehash.result()
 
-def process(db, state):
-    """Perform a signle iteration of the coordinator loop, processing exactly
-    one batch of submissions. Launch verifiers to process submissions, then
-    compute scores and store them in the database."""
-    logging.info(
-        "iteration start at: %s, cur_timestamp: %s",
-        state.batch.start_time,
-        state.current_timestamp,
-    )
-    logging.info(
-        "running for batch: %s - %s.", state.batch.start_time, state.batch.end_time
-    )
-
-    # sleep until batch ends, update the state accordingly, then continue.
-    state.wait_until_batch_ends()
-    time_intervals = list(state.batch.split(Config.MINI_BATCH_NUMBER))
 
+def run_validators(batch, time_intervals):
+    """Run the validators on the submissions of the batch and return how long
+    they took."""
     timer = Timer()
     if Config.is_test_environment():
         logging.info("running in test environment")
@@ -348,65 +430,119 @@ def process(db, state):
 
     logging.info(
         "reading ZKValidator results from a db between the time range: %s - %s",
-        state.batch.start_time,
-        state.batch.end_time,
+        batch.start_time,
+        batch.end_time,
     )
 
     logging.info("ZKValidator results read from a db in %s.", timer.duration)
     webhook_url = Config.WEBHOOK_URL
     if webhook_url is not None:
-        if timer.duration < float(Config.ALARM_ZK_LOWER_LIMIT_SEC):
+        validation_seconds = timer.duration.total_seconds()
+        if validation_seconds < Config.ALARM_ZK_LOWER_LIMIT_SEC:
             send_slack_message(
                 webhook_url,
                 f"ZkApp Validation took {timer.duration} seconds, which is too quick",
                 logging,
             )
-        if timer.duration > float(Config.ALARM_ZK_UPPER_LIMIT_SEC):
+        if validation_seconds > Config.ALARM_ZK_UPPER_LIMIT_SEC:
             send_slack_message(
                 webhook_url,
                 f"ZkApp Validation took {timer.duration}, which is too long",
                 logging,
             )
+    return timer.duration
 
+
+def process(db, state, cassandra=None):
+    """Perform a signle iteration of the coordinator loop, processing exactly
+    one batch of submissions. Launch verifiers to process submissions, then
+    compute scores and store them in the database."""
+    logging.info(
+        "iteration start at: %s, cur_timestamp: %s",
+        state.batch.start_time,
+        state.current_timestamp,
+    )
+    logging.info(
+        "running for batch: %s - %s.", state.batch.start_time, state.batch.end_time
+    )
+
+    # The database lookups don't depend on the submissions of the batch, so
+    # they run in the background while waiting for the batch to end and while
+    # the validators are at work. Each takes a connection from the pool on
+    # top of the one of the batch.
+    with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+        lookups = BatchLookups(executor, state)
+
+        # sleep until batch ends, update the state accordingly, then continue.
+        state.wait_until_batch_ends()
+        time_intervals = list(state.batch.split(Config.MINI_BATCH_NUMBER))
+
+        # The validators store their results with the submissions, so they
+        # don't have to run again when the batch is retried.
+        if state.verification_time is None:
+            state.verification_time = run_validators(state.batch, time_intervals)
+        else:
+            logging.info("validators already ran for this batch, skipping them.")
+
+    # Submissions can only be loaded once the validators are done: they store
+    # the verification results (verified, validation_error, state_hash, ...)
+    # in the submissions themselves.
     state_hash_df, all_submissions = load_submissions(
-        time_intervals, db, Config.SUBMISSION_STORAGE
+        time_intervals, db, Config.SUBMISSION_STORAGE, cassandra
     )
-    if not state_hash_df.empty:
+    try:
+        if not state_hash_df.empty:
+            # re-raises any error of the background lookups
+            previous_statehash = lookups.result()
+            bot_log_id, new_nodes = process_statehash_df(
+                db,
+                state.batch,
+                state_hash_df,
+                state.verification_time,
+                state.known_nodes,
+                previous_statehash,
+            )
+        else:
+            # process_statehash_df not processed so new bot log id hasn't been created,
+            # creating a new bot log id entry with 0 submissions processed
+            values = (
+                0,  # submissions processed
+                state.batch.end_time,
+                state.batch.start_time.timestamp(),
+                state.batch.end_time.timestamp(),
+                state.verification_time.total_seconds(),
+            )
+            bot_log_id = db.create_bot_log(values)
+            new_nodes = []
+            logging.info("Finished processing data from table.")
+
+        # The results of the batch and the scores are committed together;
+        # failing to update the scores only rolls back to here.
+        db.savepoint(SCOREBOARD_SAVEPOINT)
         try:
-            bot_log_id = process_statehash_df(
-                db, state.batch, state_hash_df, timer.duration
+            db.update_scoreboard(
+                state.batch.end_time,
+                Config.UPTIME_DAYS_FOR_SCORE,
             )
-            db.connection.commit()
+            # we only copy submissions to Postgres if we're using Cassandra as the primary storage
+            if Config.SUBMISSION_STORAGE == Config.STORAGE_CASSANDRA:
+                db.insert_submissions(all_submissions)
         except Exception as error:
-            db.connection.rollback()
+            db.rollback_to_savepoint(SCOREBOARD_SAVEPOINT)
             logging.error("ERROR: %s", error)
-            state.retry_batch()
-            return
-    else:
-        # process_statehash_df not processed so new bot log id hasn't been created,
-        # creating a new bot log id entry with 0 submissions processed
-        values = (
-            0,  # submissions processed
-            state.batch.end_time,
-            state.batch.start_time.timestamp(),
-            state.batch.end_time.timestamp(),
-            timer.duration.total_seconds(),
-        )
-        bot_log_id = db.create_bot_log(values)
-        logging.info("Finished processing data from table.")
-    try:
-        db.update_scoreboard(
-            state.batch.end_time,
-            Config.UPTIME_DAYS_FOR_SCORE,
-        )
-        # we only copy submissions to Postgres if we're using Cassandra as the primary storage
-        if Config.SUBMISSION_STORAGE == Config.STORAGE_CASSANDRA:
-            db.insert_submissions(all_submissions)
+        db.connection.commit()
+        # the block producers inserted are only known once committed
+        if new_nodes:
+            state.known_nodes.update(new_nodes)
     except Exception as error:
-        db.connection.rollback()
+        try:
+            db.connection.rollback()
+        except psycopg2.Error as rollback_error:
+            # the connection is dead; the pool discards it once it's given back
+            logging.error("ERROR rolling back: %s", rollback_error)
         logging.error("ERROR: %s", error)
-    else:
-        db.connection.commit()
+        state.retry_batch()
+        return
     state.advance_to_next_batch(bot_log_id)
 
 
@@ -427,31 +563,48 @@ def main():
     else:
         logging.info("Using SUBMISSION_STORAGE: %s", Config.SUBMISSION_STORAGE)
 
-    connection = psycopg2.connect(
-        host=Config.POSTGRES_HOST,
-        port=Config.POSTGRES_PORT,
-        database=Config.POSTGRES_DB,
-        user=Config.POSTGRES_USER,
-        password=Config.POSTGRES_PASSWORD,
-    )
+    # the pool raises instead of waiting when it runs out of connections
+    if Config.PG_POOL_MAX < DB_CONNECTIONS_PER_BATCH:
+        raise ValueError(
+            f"PG_POOL_MAX is {Config.PG_POOL_MAX}, but every batch uses "
+            f"{DB_CONNECTIONS_PER_BATCH} Postgres connections at once."
+        )
 
-    interval = Config.SURVEY_INTERVAL_MINUTES
-    db = DB(connection, logging)
-    batch = db.get_batch_timings(timedelta(minutes=interval))
-    state = State(batch)
-    while not state.stop:
-        if Config.ignore_application_status():
-            logging.info("Ignoring application status update.")
-        else:
-            try:
-                contact_details = get_contact_details_from_spreadsheet()
-                db.update_application_status(contact_details)
-            except Exception as error:
-                logging.error(
-                    "ERROR updating application status: %s", error, exc_info=True
-                )
+    # The Cassandra session and its prepared statements are kept for the
+    # whole run instead of reconnecting for every batch
+    cassandra = None
+    if Config.SUBMISSION_STORAGE == Config.STORAGE_CASSANDRA:
+        cassandra = AWSKeyspacesClient()
+        cassandra.connect()
 
-        process(db, state)
+    try:
+        with get_conn() as connection:
+            interval = Config.SURVEY_INTERVAL_MINUTES
+            db = DB(connection, logging)
+            batch = db.get_batch_timings(timedelta(minutes=interval))
+        state = State(batch)
+        while not state.stop:
+            # Every batch borrows a connection from the pool, so a connection
+            # that broke while processing one batch is not reused for the next
+            with get_conn() as connection:
+                db = DB(connection, logging)
+                if Config.ignore_application_status():
+                    logging.info("Ignoring application status update.")
+                else:
+                    try:
+                        contact_details = get_contact_details_from_spreadsheet()
+                        db.update_application_status(contact_details)
+                    except Exception as error:
+                        logging.error(
+                            "ERROR updating application status: %s",
+                            error,
+                            exc_info=True,
+                        )
+
+                process(db, state, cassandra)
+    finally:
+        if cassandra is not None:
+            cassandra.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+"""A process-wide pool of Postgres connections, shared by the coordinator and
+the database maintenance tasks."""
+
+from contextlib import contextmanager
+import threading
+
+from psycopg2 import pool
+
+from uptime_service_validation.coordinator.config import Config
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dbname=None):
+    """Return the connection pool for the given database (POSTGRES_DB by
+    default), creating it on first use. The pool keeps PG_POOL_MIN idle
+    connections open; connections given back beyond that are closed."""
+    params = Config.POSTGRES.connection_params(dbname)
+    with _pools_lock:
+        conn_pool = _pools.get(params["dbname"])
+        if conn_pool is None:
+            if not 0 < Config.PG_POOL_MIN <= Config.PG_POOL_MAX:
+                raise ValueError(
+                    f"Invalid Postgres pool size: PG_POOL_MIN={Config.PG_POOL_MIN}, "
+                    f"PG_POOL_MAX={Config.PG_POOL_MAX}. PG_POOL_MIN must be "
+                    "positive and not greater than PG_POOL_MAX."
+                )
+            conn_pool = pool.ThreadedConnectionPool(
+                minconn=Config.PG_POOL_MIN, maxconn=Config.PG_POOL_MAX, **params
+            )
+            _pools[params["dbname"]] = conn_pool
+    return conn_pool
+
+
+@contextmanager
+def get_conn(dbname=None):
+    """Borrow a connection from the pool for the duration of the block and
+    give it back afterwards. Committing is left to the caller; an unfinished
+    transaction is rolled back by the pool when the connection is returned."""
+    conn_pool = get_pool(dbname)
+    conn = conn_pool.getconn()
+    try:
+        yield conn
+    finally:
+        if not conn.closed and conn.autocommit:
+            conn.autocommit = False
+        conn_pool.putconn(conn, close=bool(conn.closed))
+
+
+def close_all():
+    "Close all pooled connections."
+    with _pools_lock:
+        for conn_pool in _pools.values():
+            conn_pool.closeall()
+        _pools.clear()
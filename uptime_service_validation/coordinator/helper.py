@@ -1,10 +1,15 @@
 """This module contains various helper functions and classes for the
 coordinator."""
 
+from collections import deque
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import datetime, timedelta, timezone
+import io
+import logging
+from operator import attrgetter
 import os
+import time
 from typing import ByteString, Optional, List
 import matplotlib.pyplot as plt
 import networkx as nx
@@ -20,7 +25,7 @@ from uptime_service_validation.coordinator.config import Config
 ERROR = "Error: {0}"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Submission:
     "Represents a submission to the network."
 
@@ -42,6 +47,20 @@ class Submission:
     verified: Optional[bool] = None
 
 
+SUBMISSION_COLUMNS = [field.name for field in fields(Submission)]
+# returns the values of a submission as a tuple, in the order of the columns
+_submission_values = attrgetter(*SUBMISSION_COLUMNS)
+
+
+def submissions_to_df(submissions):
+    """Build a DataFrame with the columns of Submission from a list of
+    submissions. The values of every submission are read in a single call and
+    pandas splits them into columns, so no dict is built per submission."""
+    return pd.DataFrame.from_records(
+        map(_submission_values, submissions), columns=SUBMISSION_COLUMNS
+    )
+
+
 class Timer:
     "This is a simple context manager to measure execution time."
 
@@ -94,7 +113,9 @@ class Batch:
 
 class DB:
     """A wrapper around the database connection, providing high-level methods
-    for querying and updating the database."""
+    for querying and updating the database. Methods writing to the database
+    log their errors and re-raise them; what to roll back is up to the
+    caller."""
 
     def __init__(self, connection, logger):
         self.connection = connection
@@ -121,6 +142,23 @@ class DB:
             start_time=prev_batch_end, bot_log_id=bot_log_id, interval=interval
         )
 
+    def savepoint(self, name):
+        "Set a savepoint in the current transaction."
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(f"SAVEPOINT {name}")
+        finally:
+            cursor.close()
+
+    def rollback_to_savepoint(self, name):
+        """Undo the changes made in the current transaction since the given
+        savepoint was set."""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+        finally:
+            cursor.close()
+
     def get_previous_statehash(self, bot_log_id):
         "Get the statehash of the latest batch."
         cursor = self.connection.cursor()
@@ -158,37 +196,36 @@ class DB:
             cursor.close()
         return state_hash
 
-    def create_statehash(self, statehash_df, page_size=100):
-        "Add a new statehashto the database."
-        tuples = [tuple(x) for x in statehash_df.to_numpy()]
-        self.logger.info("create_statehash: %s", tuples)
+    def create_statehash(self, statehash_df, page_size=1000):
+        "Add new statehashes to the database, skipping those already stored."
+        tuples = list(statehash_df.itertuples(index=False, name=None))
+        self.logger.info("create_statehash  start (%s statehashes) ", len(tuples))
         query = """INSERT INTO statehash ( value)
-                VALUES ( %s)  """
+                VALUES %s
+                ON CONFLICT (value) DO NOTHING """
         cursor = self.connection.cursor()
         try:
-            extras.execute_batch(cursor, query, tuples, page_size)
+            extras.execute_values(cursor, query, tuples, page_size=page_size)
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return -1
+            raise
         finally:
             cursor.close()
         self.logger.info("create_statehash  end ")
         return 0
 
-    def create_node_record(self, df, page_size=100):
+    def create_node_record(self, df, page_size=1000):
         "Add new block producers to the database."
         self.logger.info("create_node_record  start ")
-        tuples = [tuple(x) for x in df.to_numpy()]
+        tuples = df.itertuples(index=False, name=None)
         query = """INSERT INTO nodes ( block_producer_key, updated_at)
-                VALUES ( %s,  %s )  """
+                VALUES %s  """
         cursor = self.connection.cursor()
         try:
-            extras.execute_batch(cursor, query, tuples, page_size)
+            extras.execute_values(cursor, query, tuples, page_size=page_size)
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return 1
+            raise
         finally:
             cursor.close()
         self.logger.info("create_node_record  end ")
@@ -199,59 +236,79 @@ class DB:
         self.logger.info("create_bot_log  start ")
         query = """INSERT INTO bot_logs(files_processed, file_timestamps, batch_start_epoch, batch_end_epoch,
                 processing_time)  values ( %s, %s, %s, %s, %s) RETURNING id """
+        cursor = self.connection.cursor()
         try:
-            cursor = self.connection.cursor()
             cursor.execute(query, values)
             result = cursor.fetchone()
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return -1
+            raise
         finally:
             cursor.close()
         self.logger.info("create_bot_log  end ")
         return result[0]
 
-    def insert_statehash_results(self, df, page_size=100):
+    def insert_statehash_results(self, df, page_size=1000):
         "Relate statehashes to the batches they were observed in."
         self.logger.info("create_botlogs_statehash  start ")
         temp_df = df[["parent_state_hash", "state_hash", "weight", "bot_log_id"]]
-        tuples = [tuple(x) for x in temp_df.to_numpy()]
+        tuples = temp_df.itertuples(index=False, name=None)
         query = """INSERT INTO bot_logs_statehash(parent_statehash_id, statehash_id, weight, bot_log_id )
-                VALUES (
+                VALUES %s """
+        template = """(
                   (SELECT id FROM statehash WHERE value= %s),
                   (SELECT id FROM statehash WHERE value= %s),
                   %s,
-                  %s ) """
+                  %s )"""
         cursor = self.connection.cursor()
 
         try:
-            extras.execute_batch(cursor, query, tuples, page_size)
+            extras.execute_values(
+                cursor, query, tuples, template=template, page_size=page_size
+            )
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return 1
+            raise
         finally:
             cursor.close()
         self.logger.info("create_botlogs_statehash  end ")
         return 0
 
-    def create_point_record(self, df, page_size=100):
+    def create_point_record(self, df):
         "Add a new scoring submission to the database."
         self.logger.info("create_point_record  start ")
-        tuples = [tuple(x) for x in df.to_numpy()]
-        query = """INSERT INTO points
+        # The points are copied into a temporary table, which is much faster
+        # than inserting them in batches, and moved to the points table from
+        # there, looking up the ids of their nodes and statehashes.
+        buffer = io.StringIO()
+        df.astype(
+            {"blockchain_epoch": "Int64", "blockchain_height": "Int64"}
+        ).to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        create_query = """CREATE TEMPORARY TABLE IF NOT EXISTS points_import (
+                   file_name TEXT, file_timestamps TIMESTAMPTZ(6), blockchain_epoch BIGINT,
+                   block_producer_key TEXT, blockchain_height BIGINT, amount INT,
+                   created_at TIMESTAMPTZ(6), bot_log_id INT, state_hash TEXT)
+                ON COMMIT DELETE ROWS"""
+        insert_query = """INSERT INTO points
                    (file_name, file_timestamps, blockchain_epoch, node_id,
                    blockchain_height, amount, created_at, bot_log_id, statehash_id)
-                VALUES ( %s, %s,  %s, (SELECT id FROM nodes WHERE block_producer_key= %s),
-                         %s, %s, %s, %s, (SELECT id FROM statehash WHERE value= %s) )"""
+                SELECT file_name, file_timestamps, blockchain_epoch,
+                   (SELECT id FROM nodes WHERE block_producer_key = p.block_producer_key),
+                   blockchain_height, amount, created_at, bot_log_id,
+                   (SELECT id FROM statehash WHERE value = p.state_hash)
+                FROM points_import p"""
+        cursor = self.connection.cursor()
         try:
-            cursor = self.connection.cursor()
-            extras.execute_batch(cursor, query, tuples, page_size)
+            cursor.execute(create_query)
+            cursor.copy_expert(
+                "COPY points_import FROM STDIN WITH (FORMAT csv)", buffer
+            )
+            cursor.execute(insert_query)
+            cursor.execute("TRUNCATE points_import")
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return 1
+            raise
         finally:
             cursor.close()
         self.logger.info("create_point_record  end ")
@@ -297,8 +354,8 @@ class DB:
 
         history_sql = """insert into score_history (node_id, score_at, score, score_percent)
                       SELECT id as node_id, %s, score, score_percent from nodes where score is not null """
+        cursor = self.connection.cursor()
         try:
-            cursor = self.connection.cursor()
             cursor.execute(
                 sql,
                 (
@@ -310,8 +367,7 @@ class DB:
             cursor.execute(history_sql, (score_till_time,))
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error(ERROR.format(error))
-            cursor.close()
-            return -1
+            raise
         finally:
             cursor.close()
         self.logger.info("updateScoreboard  end ")
@@ -350,7 +406,7 @@ class DB:
         self.logger.info("update_application_status  end ")
         return 0
 
-    def insert_submissions(self, submissions):
+    def insert_submissions(self, submissions, page_size=500):
         """Insert a list of Submission objects into the submissions table."""
         self.logger.info(
             "insert_submissions  start (submissions: %s)", len(submissions)
@@ -359,7 +415,7 @@ class DB:
             INSERT INTO submissions (
                 submitted_at_date, submitted_at, submitter, remote_addr, block_hash, 
                 state_hash, parent, height, slot, validation_error, verified
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ) VALUES %s
         """
         values = [
             (
@@ -380,11 +436,10 @@ class DB:
 
         cursor = self.connection.cursor()
         try:
-            extras.execute_batch(cursor, insert_query, values)
+            extras.execute_values(cursor, insert_query, values, page_size=page_size)
         except (Exception, psycopg2.DatabaseError) as error:
             self.logger.error("Error inserting submissions: %s", error)
-            cursor.close()
-            return -1
+            raise
         finally:
             cursor.close()
         self.logger.info("insert_submissions  end")
@@ -427,35 +482,49 @@ class DB:
             # preview_query = cursor.mogrify(query, (start_date, end_date))
             # print(preview_query.decode("utf-8"))
             result = cursor.fetchall()
-            # convert the result to a list of Submission objects
-            submissions = [
-                Submission(
-                    submitted_at_date=row[0],
-                    submitted_at=row[1],
-                    submitter=row[2],
-                    created_at=row[3],
-                    block_hash=row[4],
-                    remote_addr=row[5],
-                    peer_id=row[6],
-                    graphql_control_port=row[7],
-                    built_with_commit_sha=row[8],
-                    state_hash=row[9],
-                    parent=row[10],
-                    height=row[11],
-                    slot=row[12],
-                    validation_error=row[13],
-                    verified=row[14],
-                )
-                for row in result
-            ]
+            # convert the result to a list of Submission objects; snark_work
+            # is not selected, so it is passed as None
+            submissions = [Submission(*row[:9], None, *row[9:]) for row in result]
             return submissions
         except psycopg2.Error as e:
             self.logger.error("Database error: %s", e)
             return None
 
 
+# the contact details last read from the spreadsheet, with the time.monotonic()
+# at which they were read
+_contact_details_cache = {"details": None, "read_at": None}
+
+
 def get_contact_details_from_spreadsheet():
-    "Get the contact details of the block producers from the Google spreadsheet."
+    """Get the contact details of the block producers from the Google spreadsheet.
+    The spreadsheet changes rarely, so it is read at most once every
+    SPREADSHEET_CACHE_TTL_MINUTES. If reading fails, the details read last
+    are returned instead."""
+    now = time.monotonic()
+    cached = _contact_details_cache["details"]
+    if (
+        cached is not None
+        and now - _contact_details_cache["read_at"]
+        < Config.SPREADSHEET_CACHE_TTL_MINUTES * 60
+    ):
+        return cached
+    try:
+        details = read_contact_details_from_spreadsheet()
+    except Exception as error:
+        if cached is None:
+            raise
+        logging.warning(
+            "Could not read the spreadsheet, using the contact details read last: %s",
+            error,
+        )
+        return cached
+    _contact_details_cache.update(details=details, read_at=now)
+    return details
+
+
+def read_contact_details_from_spreadsheet():
+    "Read the contact details of the block producers from the Google spreadsheet."
     os.environ["PYTHONIOENCODING"] = "utf-8"
     spreadsheet_scope = Config.SPREADSHEET_SCOPE
     spreadsheet_name = Config.SPREADSHEET_NAME
@@ -475,21 +544,32 @@ def get_contact_details_from_spreadsheet():
 
 def get_relations(df):
     "Extract parent-child relations between statehashes in a dataframe."
+    children = df["state_hash"].to_numpy()
+    parents = df["parent_state_hash"].to_numpy()
+    state_hashes = set(children)
     return (
         (parent, child)
-        for child, parent in df[["state_hash", "parent_state_hash"]].values
-        if parent in df["state_hash"].values
+        for child, parent in zip(children, parents)
+        if parent in state_hashes
     )
 
 
 def find_new_values_to_insert(existing_values, new_values):
     "Find the new values to insert into the database."
-    return (
-        existing_values.merge(new_values, how="outer", indicator=True)
-        .loc[lambda x: x["_merge"] == "right_only"]
-        .drop("_merge", axis=1)
-        .drop_duplicates()
+    # both data frames hold a single column of values, compared as hashed indexes
+    column = new_values.columns[0]
+    new_index = pd.Index(new_values[column].unique())
+    difference = new_index.difference(pd.Index(existing_values[column]), sort=False)
+    return pd.DataFrame({column: difference})
+
+
+def epoch_milliseconds(column):
+    """Convert a column of datetimes (or timestamp strings) to milliseconds
+    since the epoch, computed on the whole column at once."""
+    milliseconds = (
+        pd.to_datetime(column, utc=True).values.astype("datetime64[ms]").astype("int64")
     )
+    return pd.Series(milliseconds, index=column.index)
 
 
 def filter_state_hash_percentage(df, p=0.05):
@@ -500,13 +580,10 @@ def filter_state_hash_percentage(df, p=0.05):
     # get 5% number of blk in given batch
     total_unique_blk = df["block_producer_key"].nunique()
     percentage_result = round(total_unique_blk * p, 2)
-    good_state_hash_list = list()
-    for s in state_hash_list:
-        blk_count = df[df["state_hash"] == s]["block_producer_key"].nunique()
-        # check blk_count for state_hash submitted by blk least 5%
-        if blk_count >= percentage_result:
-            good_state_hash_list.append(s)
-    return good_state_hash_list
+    # number of distinct block producers per state_hash, counted in one pass
+    blk_counts = df.groupby("state_hash", observed=True)["block_producer_key"].nunique()
+    # check blk_count for state_hash submitted by blk least 5%
+    return [s for s in state_hash_list if blk_counts.get(s, 0) >= percentage_result]
 
 
 def create_graph(batch_df, p_selected_node_df, c_selected_node, p_map):
@@ -518,9 +595,9 @@ def create_graph(batch_df, p_selected_node_df, c_selected_node, p_map):
         list(batch_df["state_hash"].unique())
         + list(p_selected_node_df["state_hash"].values)
     )
-    selected_parent = [
+    selected_parent = {
         parent for parent in parent_hash_list if parent in state_hash_list
-    ]
+    }
 
     batch_graph.add_nodes_from(list(p_selected_node_df["state_hash"].values))
     batch_graph.add_nodes_from(c_selected_node)
@@ -541,13 +618,18 @@ def create_graph(batch_df, p_selected_node_df, c_selected_node, p_map):
 
 def apply_weights(batch_graph, c_selected_node, p_selected_node):
     "Apply weights to to statehashes,"
+    c_selected_node = set(c_selected_node)
+    # weight of the first occurrence of every previously selected statehash
+    p_weights = (
+        p_selected_node.drop_duplicates("state_hash")
+        .set_index("state_hash")["weight"]
+        .to_dict()
+    )
     for node in list(batch_graph.nodes()):
         if node in c_selected_node:
             batch_graph.nodes[node]["weight"] = 0
-        elif node in p_selected_node["state_hash"].values:
-            batch_graph.nodes[node]["weight"] = p_selected_node[
-                p_selected_node["state_hash"] == node
-            ]["weight"].values[0]
+        elif node in p_weights:
+            batch_graph.nodes[node]["weight"] = p_weights[node]
         else:
             batch_graph.nodes[node]["weight"] = 9999
 
@@ -590,17 +672,18 @@ def get_minimum_weight(graph, child_node):
 
 def bfs(graph, queue_list, node, max_depth=2):
     "Breadth-first search through the graph."
-    visited = list()
-    visited.append(node)
+    visited = {node}
+    # popping from the front of a list moves all the remaining items
+    queue = deque(queue_list)
     cnt = 2
-    while queue_list:
-        m = queue_list.pop(0)
+    while queue:
+        m = queue.popleft()
         for neighbour in list(graph.neighbors(m)):
             if neighbour not in visited:
                 graph.nodes[neighbour]["weight"] = get_minimum_weight(graph, neighbour)
-                visited.append(neighbour)
+                visited.add(neighbour)
                 # if not neighbour in visited:
-                queue_list.append(neighbour)
+                queue.append(neighbour)
         # plot_graph(graph, g_pos, str(cnt)+'.'+m)
         cnt += 1
     shortlisted_state = []
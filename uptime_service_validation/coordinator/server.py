@@ -71,12 +71,14 @@ def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
     cassandra_ip = try_get_hostname_ip(Config.CASSANDRA_HOST, logging)
     if Config.no_checks():
         logging.info("stateless-verifier will run with --no-checks flag")
+    # All jobs of the batch share a group name, which is used both to spread
+    # their pods and to monitor them with a single API call
+    job_group_name = (
+        f"delegation-verify-{datetime.now(timezone.utc).strftime('%y-%m-%d-%H-%M')}"
+    )
     for index, mini_batch in enumerate(time_intervals):
 
         # Job name
-        job_group_name = (
-            f"delegation-verify-{datetime.now(timezone.utc).strftime('%y-%m-%d-%H-%M')}"
-        )
         job_name = f"{job_group_name}-{index}"
 
         # Define the environment variables
@@ -246,7 +248,7 @@ def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
         job = client.V1Job(
             api_version="batch/v1",
             kind="Job",
-            metadata=client.V1ObjectMeta(name=job_name),
+            metadata=client.V1ObjectMeta(name=job_name, labels=pod_labels),
             spec=client.V1JobSpec(
                 ttl_seconds_after_finished=ttl_seconds,
                 template=client.V1PodTemplateSpec(
@@ -286,11 +288,19 @@ def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
         except Exception as e:
             logging.error(f"Error creating job {job_name}: {e}")
 
-    # Monitor jobs
+    # Monitor jobs, fetching the status of the whole group in one request
     while jobs:
-        for job_name in list(jobs):
-            try:
-                job_status = api_batch.read_namespaced_job_status(job_name, namespace)
+        try:
+            job_list = api_batch.list_namespaced_job(
+                namespace, label_selector=f"job-group-name={job_group_name}"
+            )
+        except Exception as e:
+            logging.error(f"Error reading job statuses for {job_group_name}: {e}")
+        else:
+            for job_status in job_list.items:
+                job_name = job_status.metadata.name
+                if job_name not in jobs:
+                    continue
                 if job_status.status.succeeded:
                     logging.info(f"Job {job_name} succeeded.")
                     jobs.remove(job_name)
@@ -305,8 +315,6 @@ def setUpValidatorPods(time_intervals, logging, worker_image, worker_tag):
                         )
                         jobs.remove(job_name)
                         exit(1)
-            except Exception as e:
-                logging.error(f"Error reading job status for {job_name}: {e}")
 
         time.sleep(10)
 